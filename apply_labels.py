@@ -0,0 +1,231 @@
+import os
+import csv
+import json
+import time
+import argparse
+from pathlib import Path
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from operation_log import OPERATION_LOG_NAME, OperationLog, MoveCommand
+
+# 清单中标注的可选写法（不区分大小写）
+SIMILAR_VALUES = ("similar", "sim", "相似", "1", "true", "yes")
+DISSIMILAR_VALUES = ("dissimilar", "dis", "不相似", "0", "false", "no")
+
+# 报告中的问题类别
+CONFLICT = "conflict"
+MISSING = "missing"
+INVALID = "invalid"
+FAILED = "failed"
+
+
+def parse_label(value):
+    """返回是否相似，无法识别时返回 None"""
+    value = str(value).strip().lower()
+    if value in SIMILAR_VALUES:
+        return True
+    if value in DISSIMILAR_VALUES:
+        return False
+    return None
+
+
+def _record_fields(record):
+    if isinstance(record, dict):
+        return record.get("path"), record.get("label")
+    return record[0], record[1]
+
+
+def read_manifest(path):
+    """
+    逐行产出清单中的 (图片路径, 标注)
+
+    支持 csv（前两列，可带表头）、json（对象或二元组的数组）和 jsonl（每行一个对象），
+    json 对象使用 path 和 label 两个字段。
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        with open(path, "r", newline="", encoding="utf-8-sig") as f:
+            for row in csv.reader(f):
+                if len(row) >= 2:
+                    yield row[0], row[1]
+    elif suffix == ".jsonl":
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield _record_fields(json.loads(line))
+    elif suffix == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            for record in json.load(f):
+                yield _record_fields(record)
+    else:
+        raise ValueError(f"不支持的清单格式: {path.suffix}")
+
+
+def group_manifest(rows, root=None):
+    """
+    按图片所在目录分组
+
+    返回 ({目录: {文件名: 是否相似}}, 问题列表)，问题为 (路径, 类别, 说明)。
+    同一文件出现多次且标注矛盾时记为冲突，不会被移动；csv 表头按无效行忽略。
+    """
+    groups = defaultdict(dict)
+    problems = []
+    contradicted = set()
+    for line_no, (raw_path, raw_label) in enumerate(rows, 1):
+        is_similar = parse_label(raw_label)
+        if is_similar is None or not raw_path:
+            if line_no > 1:
+                problems.append((raw_path, INVALID, f"第 {line_no} 行无法识别的标注"))
+            continue
+        path = Path(raw_path)
+        if root is not None and not path.is_absolute():
+            path = Path(root) / path
+        path = Path(os.path.abspath(path))
+        labels = groups[path.parent]
+        previous = labels.setdefault(path.name, is_similar)
+        if previous != is_similar and path not in contradicted:
+            contradicted.add(path)
+            problems.append((str(path), CONFLICT, "清单中的标注互相矛盾"))
+    for path in contradicted:
+        del groups[path.parent][path.name]
+    return groups, problems
+
+
+def _list_names(directory: Path) -> set:
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name for entry in entries}
+    except FileNotFoundError:
+        return set()
+
+
+def plan_directory(directory: Path, labels: dict):
+    """
+    对照目录当前状态决定每个文件的处理方式
+
+    每个目录只枚举三次（源目录、相似、不相似），不对单个文件做 stat。
+    返回 (待移动的 [(文件名, 是否相似)], 已应用的数量, 问题列表)。
+    """
+    present = _list_names(directory)
+    similar = _list_names(directory / "相似")
+    dissimilar = _list_names(directory / "不相似")
+    todo, applied, problems = [], 0, []
+    for filename, is_similar in labels.items():
+        target, other = (similar, dissimilar) if is_similar else (dissimilar, similar)
+        path = str(directory / filename)
+        if filename in present:
+            if filename in target:
+                problems.append((path, CONFLICT, "目标目录中已存在同名文件"))
+            else:
+                todo.append((filename, is_similar))
+        elif filename in target:
+            # 之前已经应用过（例如重复运行同一份清单）
+            applied += 1
+        elif filename in other:
+            problems.append((path, CONFLICT, "已被标注为相反的类别"))
+        else:
+            problems.append((path, MISSING, "文件不存在"))
+    return todo, applied, problems
+
+
+def apply_directory(directory: Path, todo, executor: ThreadPoolExecutor):
+    """
+    在线程池中执行一个目录的移动，返回失败列表
+
+    与 no_side.py 使用相同的日志：MoveCommand 移动成功并写入 move 记录后再写 label 记录，
+    移动失败的文件不会留下标注，之后在 gui 中打开该目录即可逐条撤回。
+    """
+    op_log = OperationLog(directory / OPERATION_LOG_NAME, sync_every=1024)
+    targets = {True: directory / "相似", False: directory / "不相似"}
+    for is_similar in {is_similar for _, is_similar in todo}:
+        targets[is_similar].mkdir(exist_ok=True)
+
+    def apply(item):
+        filename, is_similar = item
+        command = MoveCommand(
+            filename, directory, targets[is_similar], is_similar, op_log
+        )
+        try:
+            command.execute(make_dirs=False)
+        except OSError as e:
+            return str(directory / filename), FAILED, str(e)
+        op_log.append("label", file=filename, similar=is_similar)
+        return None
+
+    try:
+        return [result for result in executor.map(apply, todo) if result]
+    finally:
+        op_log.close()
+
+
+def apply_manifest(manifest, root=None, workers: int = 8, dry_run: bool = False):
+    """读取清单并应用所有标注，返回报告"""
+    start = time.perf_counter()
+    groups, problems = group_manifest(read_manifest(manifest), root)
+    report = {"rows": 0, "moved": 0, "applied": 0, "problems": problems}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # 先在线程池中并行对照各目录的状态
+        plans = executor.map(lambda item: plan_directory(*item), groups.items())
+        for directory, (todo, applied, dir_problems) in zip(groups, plans):
+            report["rows"] += len(groups[directory])
+            report["applied"] += applied
+            problems.extend(dir_problems)
+            if dry_run or not todo:
+                report["moved"] += len(todo) if dry_run else 0
+                continue
+            failures = apply_directory(directory, todo, executor)
+            report["moved"] += len(todo) - len(failures)
+            problems.extend(failures)
+    report["elapsed"] = time.perf_counter() - start
+    return report
+
+
+def print_report(report, report_path=None, dry_run: bool = False) -> None:
+    counts = Counter(kind for _, kind, _ in report["problems"])
+    action = "将移动" if dry_run else "已移动"
+    elapsed = report["elapsed"]
+    print(
+        f"共 {report['rows']} 个文件，{action} {report['moved']}，"
+        f"此前已应用 {report['applied']}，冲突 {counts[CONFLICT]}，"
+        f"缺失 {counts[MISSING]}，无效 {counts[INVALID]}，失败 {counts[FAILED]}，"
+        f"耗时 {elapsed:.1f} 秒（{report['rows'] / max(elapsed, 1e-9):.0f} 行/秒）"
+    )
+    if report_path:
+        with open(report_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(("path", "kind", "detail"))
+            writer.writerows(report["problems"])
+        print(f"问题列表已保存到 {report_path}")
+    else:
+        for path, kind, detail in report["problems"][:20]:
+            print(f"  [{kind}] {path}: {detail}")
+        if len(report["problems"]) > 20:
+            print(f"  …… 另有 {len(report['problems']) - 20} 条，使用 --report 导出")
+
+
+if __name__ == "__main__":
+    """
+    使用说明：
+        根据清单批量应用相似/不相似标注，无需打开 gui。
+        清单每行一个 (图片路径, similar|dissimilar)，图片被移入所在目录下的 相似/不相似 目录，
+        并写入与 no_side.py 相同的操作日志，之后可在 gui 中打开该目录撤回。
+        示例：`uv run apply_labels.py labels.csv --root "G:/path/to/dataset" -w 16`
+    """
+    parser = argparse.ArgumentParser(description="根据清单批量应用标注")
+    parser.add_argument("manifest", help="清单文件（.csv / .json / .jsonl）")
+    parser.add_argument("--root", help="清单中相对路径的根目录（默认当前目录）")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=8, help="并行移动的线程数（默认 8）"
+    )
+    parser.add_argument(
+        "-n", "--dry-run", action="store_true", help="只检查清单，不移动文件"
+    )
+    parser.add_argument("--report", help="把冲突、缺失等问题导出到该 CSV 文件")
+    args = parser.parse_args()
+
+    # MoveCommand 对每个文件输出的调试日志在批量处理时没有意义
+    logger.disable("operation_log")
+    result = apply_manifest(args.manifest, args.root, args.workers, args.dry_run)
+    print_report(result, args.report, args.dry_run)
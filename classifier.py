@@ -1,7 +1,17 @@
 import os
 import re
+import errno
 import shutil
+import tempfile
+import time
+import io
+import json
+import hashlib
 import argparse
+import threading
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from shard_archive import ShardWriter
 
 FLORIDA_CATE = {
     0: "sorrel",
@@ -91,59 +101,875 @@ CATEGORIES = {
 }
 
 
-def organize_images(input_dir, move_files=False):
+# Linux 上 FICLONE ioctl 的编号，用于创建 reflink（写时复制）副本
+FICLONE = 0x40049409
+
+# 支持的链接模式
+LINK_MODES = ("hard", "reflink", "symlink")
+
+# 链接失败时可以退回复制的错误：跨设备、文件系统或权限不支持该操作
+# 其他错误（例如目标已存在）直接报告，不会覆盖目标
+LINK_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EINVAL,
+    errno.ENOSYS,
+}
+
+
+def _link_unsupported(error):
+    return isinstance(error, ImportError) or error.errno in LINK_UNSUPPORTED
+
+
+def _check_same_file(src, dst):
+    """目标与源是同一个文件时（例如上次以链接方式整理的结果）拒绝写入"""
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError(f"'{src}' 与 '{dst}' 是同一个文件")
+
+
+def _write_replace(src, dst, write):
+    """
+    先由 write(临时文件路径) 写入目标目录下的临时文件，完成后再替换 dst
+
+    写入失败或中断时 dst 保持不变；dst 是指向 src 的链接时拒绝写入，不会截断源文件。
+    """
+    _check_same_file(src, dst)
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(dst), prefix=f".{os.path.basename(dst)}.", suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        result = write(tmp)
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return result
+
+
+def _fast_copy(src, dst):
+    """
+    在内核中完成数据复制，避免用户态缓冲区
+
+    优先使用 os.copy_file_range，其次 os.sendfile，都不可用时退回 shutil.copyfile。
+    数据先写入临时文件再替换 dst。返回实际使用的策略名称。
+    """
+    return _write_replace(src, dst, lambda tmp: _copy_data(src, tmp))
+
+
+def _copy_data(src, dst):
+    """把 src 的数据写入 dst，返回使用的策略名称"""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        for name in ("copy_file_range", "sendfile"):
+            func = getattr(os, name, None)
+            if func is None:
+                continue
+            try:
+                offset = 0
+                while offset < size:
+                    if name == "copy_file_range":
+                        sent = func(fsrc.fileno(), fdst.fileno(), size - offset)
+                    else:
+                        sent = func(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                if offset == size:
+                    return name
+            except OSError:
+                pass
+            # 失败时清空目标文件，尝试下一种方式
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+    shutil.copyfile(src, dst)
+    return "copy2"
+
+
+def _reflink(src, dst):
+    """通过 FICLONE 创建写时复制副本，不支持时抛出 OSError，dst 保持不变"""
+    import fcntl
+
+    def clone(tmp):
+        with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+    _write_replace(src, dst, clone)
+
+
+def _transfer(src, dst, move_files=False, link=None):
+    """
+    执行单个文件的传输
+
+    link 指定的方式不可用时（跨设备、文件系统不支持等），按文件退回到内核复制；
+    目标已存在等其他错误直接抛出。返回 (传输的字节数, 实际使用的策略)。
+    """
+    size = os.path.getsize(src)
+    if move_files:
+        _check_same_file(src, dst)
+        shutil.move(src, dst)
+        return size, "move"
+
+    if link is not None:
+        try:
+            if link == "hard":
+                os.link(src, dst)
+            elif link == "reflink":
+                _reflink(src, dst)
+            elif link == "symlink":
+                os.symlink(os.path.abspath(src), dst)
+            # 链接不产生数据写入
+            return 0, link
+        except (OSError, ImportError) as e:
+            if not _link_unsupported(e):
+                raise
+
+    return size, _fast_copy(src, dst)
+
+
+# 整理日志文件的后缀，日志写在输入目录旁边，例如 images.organize-journal.jsonl
+JOURNAL_SUFFIX = ".organize-journal.jsonl"
+
+
+# 重复文件报告的后缀，与日志放在一起
+DUPLICATES_SUFFIX = ".organize-duplicates.json"
+
+# 去重时部分哈希读取的字节数
+PARTIAL_HASH_SIZE = 64 * 1024
+
+# 去重处理方式：link 将重复文件硬链接到保留的文件，skip 不处理重复文件
+DEDUP_MODES = ("link", "skip")
+
+# 回滚时需要把目标移回源路径的策略
+MOVE_STRATEGIES = ("move", "dedup-move")
+
+
+def journal_path(input_dir):
+    """返回输入目录对应的日志文件路径"""
+    return os.path.normpath(os.path.abspath(input_dir)) + JOURNAL_SUFFIX
+
+
+def duplicates_path(input_dir):
+    """返回输入目录对应的重复文件报告路径"""
+    return os.path.normpath(os.path.abspath(input_dir)) + DUPLICATES_SUFFIX
+
+
+class Journal:
+    """
+    只追加的整理日志
+
+    每次整理开始时写入一行运行标记 {"run": 编号, "started": 时间}，之后每完成一次传输
+    写入一行 JSON：{"src": 源路径, "dst": 目标路径, "strategy": 策略}；回滚某次整理后
+    追加 {"rollback": 编号}。resume 时继续上一次整理的记录，不开始新的一次。
+    可被多个传输线程同时调用。
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+        runs = Journal.runs(path)
+        last = Journal.last_run_id(path)
+        # 追加句柄在整理期间保持打开，由 close() 关闭
+        self._file = open(path, "a", encoding="utf-8")  # noqa: SIM115
+        # 上一次整理已被回滚时，resume 也开始新的一次
+        if not (resume and runs and runs[-1][0] == last):
+            self._write({"run": last + 1, "started": time.time()})
+
+    def _write(self, record):
+        line = json.dumps(record)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def record(self, src, dst, strategy):
+        self._write({"src": src, "dst": dst, "strategy": strategy})
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    @staticmethod
+    def _read(path):
+        """逐行读取日志，忽略中断时写了一半的最后一行"""
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    @staticmethod
+    def last_run_id(path):
+        """日志中最大的运行编号，没有时为 0（没有运行标记的旧日志视为第 0 次）"""
+        return max(
+            (record["run"] for record in Journal._read(path) if "run" in record),
+            default=0,
+        )
+
+    @staticmethod
+    def runs(path):
+        """按顺序返回尚未回滚的各次整理 [(编号, 记录列表)]"""
+        runs = {}
+        current = 0
+        for record in Journal._read(path):
+            if "run" in record:
+                current = record["run"]
+                runs[current] = []
+            elif "rollback" in record:
+                runs.pop(record["rollback"], None)
+            else:
+                runs.setdefault(current, []).append(record)
+        return list(runs.items())
+
+    @staticmethod
+    def load(path):
+        """读取所有尚未回滚的传输记录"""
+        return [entry for _, entries in Journal.runs(path) for entry in entries]
+
+    def mark_rollback(self, run):
+        self._write({"rollback": run})
+
+
+def rollback(input_dir, all_runs=False):
+    """
+    按相反顺序重放日志，撤销最近一次整理（all_runs 为 True 时撤销所有整理）
+
+    移动的文件移回原处，复制/链接生成的文件被删除，空的类别目录随之删除；
+    更早的整理也写入过的目标文件会被保留。全部撤销后删除日志。
+    """
+    path = journal_path(input_dir)
+    runs = [(run, entries) for run, entries in Journal.runs(path) if entries]
+    if not runs:
+        print(f"错误：没有找到可回滚的日志 '{path}'")
+        return
+
+    undone = 0
+    journal = None
+    for index in reversed(range(0 if all_runs else len(runs) - 1, len(runs))):
+        run, entries = runs[index]
+        earlier = {entry["dst"] for _, older in runs[:index] for entry in older}
+        for entry in reversed(entries):
+            src, dst = entry["src"], entry["dst"]
+            try:
+                if entry["strategy"] in MOVE_STRATEGIES:
+                    os.makedirs(os.path.dirname(src), exist_ok=True)
+                    shutil.move(dst, src)
+                elif dst not in earlier:
+                    os.remove(dst)
+                undone += 1
+            except FileNotFoundError:
+                # 已经被撤销过（例如上次回滚被中断）
+                continue
+            except OSError as e:
+                print(f"错误：回滚 '{os.path.basename(dst)}' 失败: {e}")
+
+        for target_dir in {os.path.dirname(entry["dst"]) for entry in entries}:
+            try:
+                os.rmdir(target_dir)
+            except OSError:
+                pass
+        if index == 0:
+            # 已全部撤销
+            if journal is not None:
+                journal.close()
+                journal = None
+            os.remove(path)
+            break
+        if journal is None:
+            journal = Journal(path, resume=True)
+        journal.mark_rollback(run)
+    if journal is not None:
+        journal.close()
+    print(f"回滚完成！撤销文件数: {undone}")
+
+
+# 类别编号解析：匹配 sim 前的数字，预编译且以字面量 "_sim" 为锚点，不会回溯整个文件名
+CATEGORY_PATTERN = re.compile(r"_(\d+)_sim")
+
+
+def parse_category_id(filename):
+    """
+    提取文件名中 sim 前的类别编号
+
+    与原先的贪婪匹配结果一致：存在多处时取最后一处；不符合命名规则时返回 None。
+    """
+    matches = CATEGORY_PATTERN.findall(filename)
+    return int(matches[-1]) if matches else None
+
+
+def plan_images(input_dir):
+    """
+    扫描目录并生成整理计划（只读，不修改磁盘）
+
+    通过一次 os.scandir 完成枚举，文件类型来自目录项本身，不再逐个 stat。
+
+    参数:
+    input_dir (str): 包含图像的源目录路径
+
+    返回:
+    tuple: (plan, rejects)
+        plan 为 (文件名, 类别编号, 目标路径) 的列表，按文件名排序；
+        rejects 为 (文件名, 原因) 的列表
+    """
+    plan = []
+    rejects = []
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            # 跳过目录、整理日志和重复文件报告
+            if not entry.is_file() or entry.name.endswith(
+                (JOURNAL_SUFFIX, DUPLICATES_SUFFIX)
+            ):
+                continue
+
+            category_id = parse_category_id(entry.name)
+            if category_id is None:
+                rejects.append((entry.name, "不符合命名规则"))
+                continue
+            # 验证类别ID范围
+            if category_id not in CATEGORIES:
+                rejects.append((entry.name, f"无效类别ID {category_id}"))
+                continue
+
+            target = os.path.join(input_dir, CATEGORIES[category_id], entry.name)
+            plan.append((entry.name, category_id, target))
+    plan.sort()
+    rejects.sort()
+    return plan, rejects
+
+
+def print_plan(plan, rejects):
+    """打印计划中各类别的文件数和所有被拒绝的文件"""
+    counts = {}
+    for _, category_id, _ in plan:
+        counts[category_id] = counts.get(category_id, 0) + 1
+    for category_id in sorted(counts):
+        print(f"  [{category_id:2d}] {CATEGORIES[category_id]}: {counts[category_id]}")
+    print(f"计划处理文件数: {len(plan)}，跳过: {len(rejects)}")
+    for filename, reason in rejects:
+        print(f"  跳过 '{filename}': {reason}")
+
+
+def _hash_file(path, limit=None):
+    """计算文件（或其前 limit 个字节）的 BLAKE2b 摘要"""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        if limit is None:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        else:
+            digest.update(f.read(limit))
+    return digest.hexdigest()
+
+
+def _refine_groups(groups, key_func, workers):
+    """对每个候选分组中的文件并行计算 key_func，按结果拆分并只保留多于一个文件的分组"""
+    paths = [path for group in groups for path in group]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        keys = dict(zip(paths, executor.map(key_func, paths)))
+    refined = {}
+    for index, group in enumerate(groups):
+        for path in group:
+            refined.setdefault((index, keys[path]), []).append(path)
+    return [(key[1], group) for key, group in refined.items() if len(group) > 1]
+
+
+def find_duplicates(input_dir, plan, workers=1):
+    """
+    查找同一类别内内容完全相同的文件
+
+    依次按大小、前 PARTIAL_HASH_SIZE 字节的哈希、完整哈希逐级筛选，
+    大多数文件只需要一次 stat，不会被完整读取。
+
+    参数:
+    input_dir (str): 包含图像的源目录路径
+    plan (list): plan_images 生成的计划
+    workers (int): 并行 stat/哈希的线程数
+
+    返回:
+    list: 重复分组，每组为 {"category", "size", "hash", "keep", "duplicates"}，
+        keep 为保留的文件名（组内排序最前），duplicates 为其余文件名
+    """
+    paths = [os.path.join(input_dir, filename) for filename, _, _ in plan]
+    category_of = {path: entry[1] for path, entry in zip(paths, plan)}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        sizes = dict(zip(paths, executor.map(os.path.getsize, paths)))
+
+    # 第一级：同类别且大小相同
+    by_size = {}
+    for path in paths:
+        by_size.setdefault((category_of[path], sizes[path]), []).append(path)
+    candidates = [group for group in by_size.values() if len(group) > 1]
+
+    # 第二级：部分哈希
+    partial = _refine_groups(
+        candidates, lambda path: _hash_file(path, PARTIAL_HASH_SIZE), workers
+    )
+
+    # 第三级：完整哈希（文件不大于部分哈希长度时，部分哈希已是完整内容）
+    small = [(h, g) for h, g in partial if sizes[g[0]] <= PARTIAL_HASH_SIZE]
+    large = [g for h, g in partial if sizes[g[0]] > PARTIAL_HASH_SIZE]
+    full = small + _refine_groups(large, _hash_file, workers)
+
+    duplicates = []
+    for digest, group in full:
+        names = sorted(os.path.basename(path) for path in group)
+        duplicates.append(
+            {
+                "category": CATEGORIES[category_of[group[0]]],
+                "size": sizes[group[0]],
+                "hash": digest,
+                "keep": names[0],
+                "duplicates": names[1:],
+            }
+        )
+    duplicates.sort(key=lambda group: (group["category"], group["keep"]))
+    return duplicates
+
+
+def _link_duplicate(src, dst, keep_dst, move_files):
+    """
+    将重复文件硬链接到已整理好的保留文件，不支持硬链接时退回内核复制
+
+    移动模式下随后删除源文件。返回 (传输的字节数, 使用的策略)。
+    """
+    try:
+        os.link(keep_dst, dst)
+        size, strategy = 0, "dedup-hard"
+    except OSError as e:
+        if not _link_unsupported(e):
+            raise
+        size, strategy = os.path.getsize(keep_dst), f"dedup-{_fast_copy(keep_dst, dst)}"
+    if move_files:
+        os.remove(src)
+        strategy = "dedup-move"
+    return size, strategy
+
+
+def _run_entry(src, dst, move_files, link, journal, keep_dst=None):
+    """执行单个计划项，完成后立即写入日志；keep_dst 不为空时按重复文件处理"""
+    if keep_dst is not None:
+        size, strategy = _link_duplicate(src, dst, keep_dst, move_files)
+    else:
+        size, strategy = _transfer(src, dst, move_files, link)
+    if journal is not None:
+        journal.record(src, dst, strategy)
+    return size, strategy
+
+
+def new_report(input_dir):
+    """
+    创建一个空的整理报告
+
+    字段:
+    root: 处理的目录
+    processed / failed / bytes / elapsed: 计数器
+    strategies: 各传输策略的文件数
+    categories: 各类别名称的文件数
+    results: 每个成功处理文件的 (源路径, 目标路径, 使用的策略)
+    """
+    return {
+        "root": input_dir,
+        "processed": 0,
+        "failed": 0,
+        "bytes": 0,
+        "elapsed": 0.0,
+        "strategies": {},
+        "categories": {},
+        "results": [],
+    }
+
+
+def merge_report(into, report):
+    """把 report 的计数累加到 into 中"""
+    for key in ("processed", "failed", "bytes", "elapsed"):
+        into[key] += report[key]
+    for key in ("strategies", "categories"):
+        for name, count in report[key].items():
+            into[key][name] = into[key].get(name, 0) + count
+    into["results"].extend(report["results"])
+    return into
+
+
+def execute_plan(
+    input_dir,
+    plan,
+    move_files=False,
+    workers=1,
+    link=None,
+    journal=None,
+    keep_targets=None,
+):
+    """
+    按计划执行文件传输
+
+    参数:
+    input_dir (str): 包含图像的源目录路径
+    plan (list): plan_images 生成的计划
+    move_files (bool): True表示移动文件，False表示复制文件
+    workers (int): 并行传输的线程数
+    link (str): 复制时改为创建链接，可选 hard/reflink/symlink，不支持时按文件退回复制
+    journal (Journal): 记录已完成传输的日志，为 None 时不记录
+    keep_targets (dict): 重复文件名到其保留文件目标路径的映射，这些文件改为链接到保留文件
+
+    返回:
+    dict: new_report 格式的整理报告
+    """
+    keep_targets = keep_targets or {}
+    report = new_report(input_dir)
+
+    # 每个类别目录只创建一次
+    for category_id in {entry[1] for entry in plan}:
+        os.makedirs(os.path.join(input_dir, CATEGORIES[category_id]), exist_ok=True)
+
+    # 在线程池中执行传输，按计划顺序输出结果
+    strategies = report["strategies"]
+    categories = report["categories"]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [
+            executor.submit(
+                _run_entry,
+                os.path.join(input_dir, filename),
+                dst,
+                move_files,
+                link,
+                journal,
+                keep_targets.get(filename),
+            )
+            for filename, _, dst in plan
+        ]
+        for (filename, category_id, dst), future in zip(plan, futures):
+            try:
+                size, strategy = future.result()
+            except OSError as e:
+                report["failed"] += 1
+                print(f"错误：处理 '{filename}' 失败: {e}")
+                continue
+            report["processed"] += 1
+            report["bytes"] += size
+            strategies[strategy] = strategies.get(strategy, 0) + 1
+            name = CATEGORIES[category_id]
+            categories[name] = categories.get(name, 0) + 1
+            report["results"].append((os.path.join(input_dir, filename), dst, strategy))
+    report["elapsed"] = time.perf_counter() - start
+
+    mode = "移动" if move_files else (f"链接({link})" if link else "复制")
+    print(f"操作完成！处理文件数: {report['processed']}，失败: {report['failed']}")
+    print(f"模式: {mode}文件，线程数: {max(1, workers)}")
+    print_throughput(report)
+    return report
+
+
+def print_throughput(report):
+    """打印报告中的传输策略和吞吐量"""
+    elapsed = max(report["elapsed"], 1e-9)
+    strategies = report["strategies"]
+    print(f"传输策略: {', '.join(f'{k}={v}' for k, v in sorted(strategies.items()))}")
+    print(
+        f"吞吐量: {report['processed'] / elapsed:.1f} 文件/秒, "
+        f"{report['bytes'] / elapsed / 1024 / 1024:.2f} MB/秒 "
+        f"(耗时 {elapsed:.2f} 秒)"
+    )
+
+
+def _archive_category(output_dir, category_id, entries, input_dir, shard_size):
+    """把一个类别的文件依次写入分片，返回 (文件名, 字节数或异常) 的列表"""
+    writer = ShardWriter(output_dir, CATEGORIES[category_id], shard_size)
+    outcomes = []
+    try:
+        for filename in entries:
+            try:
+                outcomes.append(
+                    (filename, writer.add(os.path.join(input_dir, filename), filename))
+                )
+            except OSError as e:
+                outcomes.append((filename, e))
+    finally:
+        writer.close()
+    return outcomes
+
+
+def archive_plan(input_dir, plan, output_dir, shard_size, workers=1):
+    """
+    按计划把各类别的图片写入 tar 分片，而不是逐个复制到类别目录
+
+    每个类别一个写入器，多个类别在线程池中并行写入；源文件不会被修改。
+
+    参数:
+    input_dir (str): 包含图像的源目录路径
+    plan (list): plan_images 生成的计划
+    output_dir (str): 分片和索引的输出目录
+    shard_size (int): 单个分片的大小上限（字节）
+    workers (int): 并行写入的类别数
+
+    返回:
+    dict: new_report 格式的整理报告
+    """
+    report = new_report(input_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    by_category = {}
+    for filename, category_id, _ in plan:
+        by_category.setdefault(category_id, []).append(filename)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            category_id: executor.submit(
+                _archive_category,
+                output_dir,
+                category_id,
+                entries,
+                input_dir,
+                shard_size,
+            )
+            for category_id, entries in sorted(by_category.items())
+        }
+        for category_id, future in futures.items():
+            name = CATEGORIES[category_id]
+            for filename, outcome in future.result():
+                if isinstance(outcome, OSError):
+                    report["failed"] += 1
+                    print(f"错误：处理 '{filename}' 失败: {outcome}")
+                    continue
+                report["processed"] += 1
+                report["bytes"] += outcome
+                report["categories"][name] = report["categories"].get(name, 0) + 1
+    report["elapsed"] = time.perf_counter() - start
+    report["strategies"] = {"archive": report["processed"]}
+
+    print(f"操作完成！处理文件数: {report['processed']}，失败: {report['failed']}")
+    print(f"模式: 写入分片 '{output_dir}'，分片上限: {shard_size / 1024 / 1024:.0f} MB")
+    print_throughput(report)
+    return report
+
+
+def organize_images(
+    input_dir,
+    move_files=False,
+    workers=1,
+    link=None,
+    dry_run=False,
+    resume=False,
+    dedup=None,
+    archive=None,
+    shard_size=1024 * 1024 * 1024,
+):
     """
     根据文件名中的类别编号整理图像文件
 
     参数:
     input_dir (str): 包含图像的源目录路径
     move_files (bool): True表示移动文件，False表示复制文件
+    workers (int): 并行传输的线程数
+    link (str): 复制时改为创建链接，可选 hard/reflink/symlink，不支持时按文件退回复制
+    dry_run (bool): 只打印计划，不修改磁盘
+    resume (bool): 根据日志跳过上次已完成的文件，并继续追加日志
+    dedup (str): 类别内去重方式，link 硬链接到保留文件，skip 不处理重复文件，None 不去重
+    archive (str): 不为空时把各类别写入该目录下的 tar 分片，不再创建类别目录
+    shard_size (int): 分片模式下单个分片的大小上限（字节）
+
+    返回:
+    dict: new_report 格式的整理报告，目录不存在时返回 None
     """
     # 验证目录是否存在
     if not os.path.isdir(input_dir):
         print(f"错误：目录 '{input_dir}' 不存在")
         return
+    # 使用绝对路径，保证日志记录与后续恢复时的路径一致
+    input_dir = os.path.abspath(input_dir)
 
-    # 处理文件的操作函数
-    file_operation = shutil.move if move_files else shutil.copy2
+    # 第一阶段：规划
+    plan, rejects = plan_images(input_dir)
+    path = journal_path(input_dir)
+    if resume:
+        # 只比对日志记录，不需要重新 stat 目标目录
+        done = {entry["src"] for entry in Journal.load(path)}
+        skipped = len(plan)
+        plan = [e for e in plan if os.path.join(input_dir, e[0]) not in done]
+        print(f"从日志恢复：跳过已完成文件 {skipped - len(plan)} 个")
+    duplicates = []
+    if dedup is not None:
+        duplicates = find_duplicates(input_dir, plan, workers)
+        count = sum(len(group["duplicates"]) for group in duplicates)
+        print(f"重复文件: {len(duplicates)} 组，共 {count} 个重复文件")
+    if dry_run:
+        print_plan(plan, rejects)
+        for group in duplicates:
+            print(f"  重复 '{group['keep']}': {', '.join(group['duplicates'])}")
+        return new_report(input_dir)
+    for filename, reason in rejects:
+        print(f"警告：文件 '{filename}' {reason}，跳过")
+    if archive is not None:
+        # 分片模式只读取源文件，重复文件直接不写入
+        skipped = {name for group in duplicates for name in group["duplicates"]}
+        plan = [entry for entry in plan if entry[0] not in skipped]
+        return archive_plan(input_dir, plan, archive, shard_size, workers)
+    if dedup is not None:
+        with open(duplicates_path(input_dir), "w", encoding="utf-8") as f:
+            json.dump(duplicates, f, ensure_ascii=False, indent=2)
 
-    processed = 0
-    # 遍历目录中的文件
-    for filename in os.listdir(input_dir):
-        filepath = os.path.join(input_dir, filename)
+    # 重复文件从计划中拆出，保留的文件先整理完成后再处理
+    keep_targets = {}
+    for group in duplicates:
+        keep_dst = os.path.join(input_dir, group["category"], group["keep"])
+        for filename in group["duplicates"]:
+            keep_targets[filename] = keep_dst
+    dup_plan = [entry for entry in plan if entry[0] in keep_targets]
+    plan = [entry for entry in plan if entry[0] not in keep_targets]
 
-        # 跳过目录
-        if not os.path.isfile(filepath):
-            continue
+    # 第二阶段：执行同一份计划
+    journal = Journal(path, resume=resume)
+    try:
+        report = execute_plan(input_dir, plan, move_files, workers, link, journal)
+        if dedup == "link" and dup_plan:
+            print("处理重复文件：")
+            merge_report(
+                report,
+                execute_plan(
+                    input_dir,
+                    dup_plan,
+                    move_files,
+                    workers,
+                    link,
+                    journal,
+                    keep_targets,
+                ),
+            )
+        return report
+    finally:
+        journal.close()
 
-        # 提取类别编号
-        match = re.match(r".*_(\d+)_sim.*", filename)
-        if not match:
-            print(f"警告：文件 '{filename}' 不符合命名规则，跳过")
-            continue
 
-        try:
-            category_id = int(match.group(1))
-            # 验证类别ID范围
-            if category_id not in CATEGORIES:
-                print(f"警告：无效类别ID {category_id}，文件 '{filename}' 跳过")
+def discover_directories(roots, recursive=False):
+    """
+    展开需要整理的目录列表
+
+    recursive 为 True 时包含每个根目录下的所有子目录，但跳过隐藏目录和已生成的类别目录。
+    """
+    category_names = set(CATEGORIES.values())
+    directories = []
+    for root in roots:
+        stack = [os.path.abspath(root)]
+        while stack:
+            directory = stack.pop()
+            directories.append(directory)
+            if not recursive:
+                continue
+            try:
+                with os.scandir(directory) as entries:
+                    subdirs = [
+                        entry.path
+                        for entry in entries
+                        if entry.is_dir(follow_symlinks=False)
+                        and not entry.name.startswith(".")
+                        and entry.name not in category_names
+                    ]
+            except PermissionError:
                 continue
+            stack.extend(sorted(subdirs, reverse=True))
+    return directories
+
 
-            category_name = CATEGORIES[category_id]
-            target_dir = os.path.join(input_dir, category_name)
+def _organize_shard(input_dir, options):
+    """在工作进程中整理一个目录，返回 (该目录的输出文本, 报告)"""
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        report = organize_images(input_dir, **options)
+    if report is not None:
+        # 明细不需要跨进程传回
+        report["results"] = []
+    return buffer.getvalue(), report
 
-            # 创建类别目录
-            os.makedirs(target_dir, exist_ok=True)
 
-            # 移动/复制文件
-            file_operation(filepath, os.path.join(target_dir, filename))
-            processed += 1
+def archive_options(directory, directories, options):
+    """
+    分片模式下为每个目录使用 --archive 下独立的子目录
+
+    子目录为该目录相对所有目录公共上级的路径，分片和索引不会互相覆盖。
+    """
+    if options.get("archive") is None:
+        return options
+    try:
+        relative = os.path.relpath(directory, os.path.commonpath(directories))
+    except ValueError:
+        # 不在同一个驱动器上，没有公共上级
+        drive, rest = os.path.splitdrive(directory)
+        relative = os.path.join(drive.rstrip(":\\/"), rest.lstrip("\\/"))
+    return dict(
+        options, archive=os.path.normpath(os.path.join(options["archive"], relative))
+    )
+
+
+def organize_many(directories, processes=1, **options):
+    """
+    在进程池中按目录分片整理，并合并各分片的报告
+
+    每个分片的输出在该分片完成后整体打印，顺序与 directories 一致。
+    分片模式下各目录写入 --archive 下各自的子目录（见 archive_options）。
+
+    参数:
+    directories (list): 需要整理的目录
+    processes (int): 进程数
+    options: 透传给 organize_images 的参数
+
+    返回:
+    list: 各目录的报告
+    """
+    reports = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, processes)) as executor:
+        futures = [
+            executor.submit(
+                _organize_shard,
+                directory,
+                archive_options(directory, directories, options),
+            )
+            for directory in directories
+        ]
+        for directory, future in zip(directories, futures):
+            print(f"===== {directory} =====")
+            try:
+                output, report = future.result()
+            except Exception as e:
+                print(f"错误：整理目录 '{directory}' 失败: {e}")
+                continue
+            print(output, end="")
+            if report is not None:
+                reports.append(report)
+    elapsed = time.perf_counter() - start
+    print_merged_report(reports, elapsed)
+    return reports
 
-        except (ValueError, TypeError):
-            print(f"警告：无法解析 '{filename}' 中的类别编号")
 
-    print(f"操作完成！处理文件数: {processed}")
-    print(f"模式: {'移动' if move_files else '复制'}文件")
+def print_merged_report(reports, elapsed):
+    """打印合并后的报告：各目录与各类别的合计"""
+    merged = new_report("")
+    print("===== 汇总 =====")
+    for report in reports:
+        print(
+            f"  {report['root']}: 处理 {report['processed']}，失败 {report['failed']}"
+        )
+        merge_report(merged, report)
+    # 各分片并行执行，吞吐量按总耗时计算
+    merged["elapsed"] = elapsed
+    for name, count in sorted(merged["categories"].items()):
+        print(f"  {name}: {count}")
+    print(
+        f"目录数: {len(reports)}，处理文件数: {merged['processed']}，"
+        f"失败: {merged['failed']}"
+    )
+    print_throughput(merged)
 
 
 if __name__ == "__main__":
@@ -151,15 +977,80 @@ if __name__ == "__main__":
     使用说明：
         对于给定目录中的文件进行分类，按照sim前的数字编号划分到对应的类中。可以通过move参数指定以移动或者复制的形式对文件进行分类。
         示例：`uv run classifier.py "G:/path/to/images/folder" -m` 表示以移动的方式将"G:/path/to/images/folder"目录下的文件进行分类
+        可以同时指定多个目录，或通过 -r 递归处理子目录，并通过 -p 指定并行的进程数。
     作者：胡舒涵
     历史记录：
     2025-06-18  胡舒涵  创建脚本。
     """
     parser = argparse.ArgumentParser(description="根据文件名中的类别编号整理图像")
-    parser.add_argument("directory", help="包含图像的目录路径")
+    parser.add_argument("directories", nargs="+", help="包含图像的目录路径")
     parser.add_argument(
         "-m", "--move", action="store_true", help="移动文件而非复制文件（默认是复制）"
     )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="并行传输的线程数（默认 1）"
+    )
+    parser.add_argument(
+        "--link",
+        choices=LINK_MODES,
+        help="以链接代替复制：hard 硬链接、reflink 写时复制、symlink 符号链接",
+    )
+    parser.add_argument(
+        "-n", "--dry-run", action="store_true", help="只打印整理计划，不修改文件"
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="根据日志跳过上次已完成的文件"
+    )
+    parser.add_argument(
+        "--rollback", action="store_true", help="按日志逆序撤销最近一次整理"
+    )
+    parser.add_argument(
+        "--rollback-all", action="store_true", help="按日志逆序撤销所有整理"
+    )
+    parser.add_argument(
+        "--dedup",
+        choices=DEDUP_MODES,
+        help="类别内去重：link 将重复文件硬链接到保留文件，skip 不处理重复文件",
+    )
+    parser.add_argument(
+        "--archive",
+        help="把各类别写入该目录下大小受限的 tar 分片（含偏移索引），"
+        "多个目录时各自写入以相对路径命名的子目录",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=1024,
+        help="分片模式下单个分片的上限 MB（默认 1024）",
+    )
+    parser.add_argument(
+        "-r", "--recursive", action="store_true", help="同时整理所有子目录"
+    )
+    parser.add_argument(
+        "-p", "--processes", type=int, default=1, help="按目录分片的进程数（默认 1）"
+    )
 
     args = parser.parse_args()
-    organize_images(args.directory, move_files=args.move)
+    if args.move and args.link:
+        parser.error("--move 与 --link 不能同时使用")
+    if args.archive and (args.move or args.link or args.resume):
+        parser.error("--archive 不能与 --move、--link 或 --resume 同时使用")
+    directories = discover_directories(args.directories, recursive=args.recursive)
+    if args.rollback or args.rollback_all:
+        for directory in directories:
+            rollback(directory, all_runs=args.rollback_all)
+        raise SystemExit
+    options = dict(
+        move_files=args.move,
+        workers=args.workers,
+        link=args.link,
+        dry_run=args.dry_run,
+        resume=args.resume,
+        dedup=args.dedup,
+        archive=args.archive,
+        shard_size=args.shard_size * 1024 * 1024,
+    )
+    if len(directories) == 1:
+        organize_images(directories[0], **options)
+    else:
+        organize_many(directories, processes=args.processes, **options)
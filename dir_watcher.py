@@ -0,0 +1,251 @@
+import os
+import time
+import ctypes
+import ctypes.util
+import errno
+import struct
+import selectors
+import threading
+from loguru import logger
+
+# inotify 常量（见 <sys/inotify.h>）
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_CREATE
+    | IN_DELETE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+# 收到第一个事件后继续收集的时间（秒），这段时间内的变化合并为一次回调
+COALESCE_DELAY = 0.1
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except (OSError, TypeError):
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+def _watched_dirs(root):
+    """root 及其下所有非隐藏目录"""
+    for directory, dirnames, _ in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        yield directory
+
+
+class InotifyWatcher:
+    """
+    基于 Linux inotify 的目录树监控
+
+    为每个目录添加一个 watch，新建的子目录自动加入。后台线程通过 selectors 等待事件，
+    一批事件合并为发生变化的目录集合后调用一次 callback(dirs)（在后台线程中调用）。
+    遍历目录树添加 watch 也在后台线程中进行，不阻塞调用方；inotify 不可用时抛出 OSError，
+    由调用方改用轮询，watch 数量达到上限时后台线程自行改为轮询。
+    """
+
+    def __init__(self, root, callback, libc=None):
+        self.root = root
+        self.callback = callback
+        self.libc = libc or _load_libc()
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, "inotify 不可用")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.paths = {}
+        self.stopped = False
+        self.fallback = None
+        self.thread = threading.Thread(
+            target=self._run, name="inotify-watcher", daemon=True
+        )
+
+    def _add_watch(self, directory) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                # 目录已被删除或无权访问，跳过即可
+                return
+            # ENOSPC：超出 fs.inotify.max_user_watches
+            raise OSError(error, f"inotify_add_watch 失败: {directory}")
+        self.paths[wd] = directory
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped = True
+        if self.fallback is not None:
+            self.fallback.stop()
+
+    def _read_events(self, changed: set) -> None:
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # 内核队列溢出，丢失的事件无法得知，同步所有目录
+                changed.update(self.paths.values())
+                continue
+            directory = self.paths.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.paths[wd]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(os.path.dirname(directory))
+                continue
+            changed.add(directory)
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # 新目录：加入监控，其中已有的内容通过同步该目录得到
+                for subdir in _watched_dirs(path):
+                    self._add_watch(subdir)
+
+    def _run(self) -> None:
+        try:
+            try:
+                for directory in _watched_dirs(self.root):
+                    if self.stopped:
+                        return
+                    self._add_watch(directory)
+                self._watch()
+            finally:
+                os.close(self.fd)
+        except OSError as e:
+            if self.stopped:
+                return
+            # 超出 watch 上限：改为在本线程中轮询
+            logger.warning(f"inotify 监控失败，改为轮询目录: {e}")
+            self.fallback = PollWatcher(self.root, self.callback)
+            if not self.stopped:
+                self.fallback._run()
+
+    def _watch(self) -> None:
+        selector = selectors.DefaultSelector()
+        selector.register(self.fd, selectors.EVENT_READ)
+        try:
+            while not self.stopped:
+                if not selector.select(timeout=0.5):
+                    continue
+                changed = set()
+                deadline = time.monotonic() + COALESCE_DELAY
+                while True:
+                    self._read_events(changed)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not selector.select(timeout=remaining):
+                        break
+                if changed and not self.stopped:
+                    self.callback(changed)
+        finally:
+            selector.close()
+
+
+class PollWatcher:
+    """
+    inotify 不可用时的轮询监控
+
+    每隔 interval 秒只 stat 一次每个已知目录，目录的 mtime 在其中的条目增删时改变；
+    mtime 变化的目录重新枚举一层以发现新的子目录，不会逐个文件检查。
+    初始的目录 mtime 在后台线程中记录。
+    """
+
+    def __init__(self, root, callback, interval: float = 1.0):
+        self.root = root
+        self.callback = callback
+        self.interval = interval
+        self.stopped = False
+        self.mtimes = {}
+        self.thread = threading.Thread(
+            target=self._run, name="poll-watcher", daemon=True
+        )
+
+    def _remember(self, directory) -> None:
+        try:
+            self.mtimes[directory] = os.stat(directory).st_mtime_ns
+        except OSError:
+            pass
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped = True
+
+    def _run(self) -> None:
+        for directory in _watched_dirs(self.root):
+            if self.stopped:
+                return
+            self._remember(directory)
+        while not self.stopped:
+            time.sleep(self.interval)
+            changed = set()
+            for directory, mtime in list(self.mtimes.items()):
+                try:
+                    current = os.stat(directory).st_mtime_ns
+                except OSError:
+                    # 目录已被删除
+                    del self.mtimes[directory]
+                    changed.add(os.path.dirname(directory))
+                    continue
+                if current == mtime:
+                    continue
+                self.mtimes[directory] = current
+                changed.add(directory)
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            if (
+                                entry.is_dir()
+                                and not entry.name.startswith(".")
+                                and entry.path not in self.mtimes
+                            ):
+                                for subdir in _watched_dirs(entry.path):
+                                    self._remember(subdir)
+                except OSError:
+                    pass
+            if changed and not self.stopped:
+                self.callback(changed)
+
+
+def watch_directory(root, callback):
+    """
+    监控 root 目录树，变化的目录集合通过 callback 在后台线程中传出
+
+    优先使用 inotify，不可用或超出 watch 上限时退回到轮询目录 mtime。
+    """
+    try:
+        watcher = InotifyWatcher(root, callback)
+    except OSError as e:
+        logger.warning(f"inotify 不可用，改为轮询目录: {e}")
+        watcher = PollWatcher(root, callback)
+    watcher.start()
+    return watcher
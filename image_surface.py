@@ -0,0 +1,54 @@
+import tkinter as tk
+from PIL import Image, ImageTk
+
+
+class ImageSurface(tk.Canvas):
+    """
+    复用 PhotoImage 缓冲区的图片显示区域
+
+    持有两个不小于画布的 RGB 缓冲区：新图片 paste() 到当前未显示的缓冲区左上角，
+    再把画布上的图片项切换过去并居中，留白部分显示画布背景。
+    缓冲区只在画布或图片变大时重新分配，持续切换图片时内存保持不变。
+    """
+
+    def __init__(self, master, **kwargs):
+        kwargs.setdefault("highlightthickness", 0)
+        super().__init__(master, **kwargs)
+        # 每个缓冲区以及其中上一次写入的图片尺寸
+        self.buffers = [None, None]
+        self.filled = [None, None]
+        self.front = 0
+        self.shown_size = None
+        self.item = self.create_image(0, 0, anchor=tk.NW)
+        self.bind("<Configure>", lambda event: self.center())
+
+    def show(self, img: Image.Image) -> None:
+        back = 1 - self.front
+        buffer = self.buffers[back]
+        width = max(self.winfo_width(), img.width)
+        height = max(self.winfo_height(), img.height)
+        if buffer is None or width > buffer.width() or height > buffer.height():
+            buffer = self.buffers[back] = ImageTk.PhotoImage("RGB", (width, height))
+        elif self.filled[back] is not None and (
+            img.width < self.filled[back][0] or img.height < self.filled[back][1]
+        ):
+            # 新图片覆盖不了上次写入的区域，先清空为透明
+            self.tk.call(str(buffer), "blank")
+        # 写入未显示的缓冲区，避免对正在显示的图片逐块重绘
+        buffer.paste(img)
+        self.filled[back] = img.size
+        self.itemconfig(self.item, image=buffer)
+        self.front = back
+        self.shown_size = img.size
+        self.center()
+
+    def clear(self) -> None:
+        self.itemconfig(self.item, image="")
+        self.shown_size = None
+
+    def center(self) -> None:
+        if self.shown_size is None:
+            return
+        x = (self.winfo_width() - self.shown_size[0]) // 2
+        y = (self.winfo_height() - self.shown_size[1]) // 2
+        self.coords(self.item, max(x, 0), max(y, 0))
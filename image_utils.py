@@ -0,0 +1,78 @@
+import time
+from PIL import Image
+
+# 显示质量：fast 使用 JPEG DCT 缩放和整数倍 reduce，exact 对原图做完整的 LANCZOS 缩放
+QUALITY_MODES = ("fast", "exact")
+
+# 缩小倍数达到该值时，先用 reduce() 做整数倍缩小，再做最后一次重采样
+REDUCING_GAP = 3.0
+
+
+def fit_size(
+    image_size: tuple[int, int], box: tuple[int, int], upscale: bool = True
+) -> tuple[int, int]:
+    """
+    计算按比例放入 box（宽, 高）的尺寸
+
+    upscale 为 False 时，小于 box 的图片保持原尺寸。
+    """
+    width, height = image_size
+    box_width, box_height = max(box[0], 1), max(box[1], 1)
+    ratio = min(box_width / width, box_height / height)
+    if not upscale:
+        ratio = min(ratio, 1.0)
+    return max(int(width * ratio), 1), max(int(height * ratio), 1)
+
+
+def choose_filter(source: tuple[int, int], target: tuple[int, int]):
+    """按缩放倍数选择重采样滤波器"""
+    factor = max(source[0] / target[0], source[1] / target[1])
+    if factor < 1.0:
+        # 放大时插值质量差别不明显
+        return Image.Resampling.BILINEAR
+    if factor >= REDUCING_GAP:
+        # 大倍数缩小已由 reduce() 的盒式滤波完成，剩余部分用双线性即可
+        return Image.Resampling.BILINEAR
+    return Image.Resampling.BICUBIC
+
+
+def _add_timing(timings, stage: str, seconds: float) -> None:
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def load_display_image(
+    path,
+    box: tuple[int, int],
+    quality: str = "fast",
+    upscale: bool = True,
+    timings: dict | None = None,
+) -> Image.Image:
+    """
+    加载用于显示的图片，按比例缩放到适应 box（宽, 高）的大小
+
+    fast 模式下 JPEG 通过 Image.draft 直接以 1/2、1/4、1/8 的分辨率解码，
+    其他格式通过 reducing_gap 先做整数倍 reduce()，再按倍数选择滤波器；
+    exact 模式解码完整原图并使用 LANCZOS。
+    timings 不为 None 时，解码和缩放的耗时（秒）累加到其中的 decode/resize 键。
+    """
+    start = time.perf_counter()
+    img = Image.open(path)
+    target = fit_size(img.size, box, upscale)
+    if quality != "exact" and target != img.size:
+        # 仅对 JPEG 生效，解码时的尺寸不会小于 target
+        img.draft(img.mode, target)
+    img.load()
+    decoded = time.perf_counter()
+    _add_timing(timings, "decode", decoded - start)
+    if target == img.size:
+        return img
+
+    if quality == "exact":
+        img = img.resize(target, Image.Resampling.LANCZOS)
+    else:
+        img = img.resize(
+            target, choose_filter(img.size, target), reducing_gap=REDUCING_GAP
+        )
+    _add_timing(timings, "resize", time.perf_counter() - decoded)
+    return img
@@ -0,0 +1,82 @@
+import csv
+import time
+import threading
+from collections import deque
+
+# 按键到绘制完成的各阶段
+STAGES = ("decode", "resize", "photo", "move", "total")
+
+
+class LatencyRecorder:
+    """
+    按键到绘制完成的延迟统计
+
+    begin() 在按键处理开始时调用，end() 在界面重绘之后调用（通过 after_idle），
+    期间各阶段的耗时累加到 timings 中。每个阶段保留最近 window 个样本用于计算
+    p50/p95/p99，所有样本按行保存，退出时可导出为 CSV。
+    未开启统计时调用方持有 None，不会产生任何开销。
+    """
+
+    def __init__(self, window: int = 1000):
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self.rows = []
+        self.lock = threading.Lock()
+        self.event = None
+        self.started = None
+        self.timings = {}
+
+    def begin(self, event: str) -> None:
+        self.event = event
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        """累加当前按键某个阶段的耗时"""
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def end(self) -> None:
+        if self.started is None:
+            return
+        self.timings["total"] = time.perf_counter() - self.started
+        self._record(self.event, self.timings)
+        self.started = None
+
+    def record(self, stage: str, seconds: float) -> None:
+        """记录一次与按键无关的独立样本，例如后台线程中的文件移动"""
+        self._record(stage, {stage: seconds})
+
+    def _record(self, event: str, timings: dict) -> None:
+        with self.lock:
+            for stage, seconds in timings.items():
+                self.samples[stage].append(seconds)
+            self.rows.append(
+                (time.time(), event, *(timings.get(stage, "") for stage in STAGES))
+            )
+
+    def percentiles(self, stage: str) -> tuple[float, float, float]:
+        """返回某阶段最近样本的 (p50, p95, p99)，单位毫秒"""
+        with self.lock:
+            values = sorted(self.samples[stage])
+        if not values:
+            return 0.0, 0.0, 0.0
+
+        def pick(q):
+            return values[min(int(q * len(values)), len(values) - 1)] * 1000
+
+        return pick(0.50), pick(0.95), pick(0.99)
+
+    def summary(self) -> str:
+        lines = []
+        for stage in STAGES:
+            if self.samples[stage]:
+                p50, p95, p99 = self.percentiles(stage)
+                lines.append(f"{stage}: p50={p50:.1f} p95={p95:.1f} p99={p99:.1f} ms")
+        return "\n".join(lines)
+
+    def dump_csv(self, path) -> None:
+        with self.lock:
+            rows = list(self.rows)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(("timestamp", "event", *STAGES))
+            writer.writerows(rows)
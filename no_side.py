@@ -1,62 +1,454 @@
 import os
-import shutil
+import time
+import queue
+import heapq
+import argparse
+import threading
 import tkinter as tk
 from pathlib import Path
-from collections import deque
-from abc import abstractmethod
-from tkinter import filedialog
-from PIL import Image, ImageTk
+from functools import partial
+from itertools import chain, islice
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import filedialog, ttk
+from PIL import Image
 from loguru import logger
+from image_surface import ImageSurface
+from image_utils import QUALITY_MODES, load_display_image
+from latency import LatencyRecorder
+from operation_log import (
+    OPERATION_LOG_NAME,
+    Command,
+    MoveCommand,
+    OperationLog,
+    mtime_ns,
+)
+from thumb_cache import DEFAULT_CACHE_DIR, ThumbnailCache
 
+# 支持的图片扩展名
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp")
 
-class Command:
-    @abstractmethod
-    def execute(): ...
-    @abstractmethod
-    def undo(): ...
+# 网格模式下单元格的背景色：普通 / 标记为例外
+GRID_BG = "#f0f0f0"
+GRID_EXCEPTION_BG = "#ffcc66"
 
 
-class MoveCommand(Command):
-    def __init__(self, filename: str, src_dir: str, dst_dir: str, is_similar: bool):
+class BatchCommand(Command):
+    """
+    网格模式下一整页的标注，由多个 MoveCommand 组成
+
+    在缓冲区中只占一个位置，撤回时整页一起撤回；提交给执行器时拆分为单个移动，
+    仍按目标目录分批执行。
+    """
+
+    def __init__(self, commands: list[MoveCommand], is_similar: bool):
         super().__init__()
-        self.filename = filename
+        self.commands = commands
         self.is_similar = is_similar
-        self.src_dir = Path(src_dir)
-        self.dst_dir = Path(dst_dir)
-
-    def execute(self):
-        logger.debug(f"execute: {self.filename}(sim-{self.is_similar})")
-        if not self.dst_dir.exists():
-            self.dst_dir.mkdir(parents=True, exist_ok=True)
-        src_path = self.src_dir / self.filename
-        dst_path = self.dst_dir / self.filename
+        self.filename = f"{commands[0].filename} 等 {len(commands)} 张"
+
+    def execute(self, make_dirs: bool = True):
+        for command in self.commands:
+            command.execute(make_dirs)
+
+    def undo(self):
+        """按相反顺序撤回已移动的文件"""
+        for command in reversed(self.commands):
+            if command.executed:
+                command.undo()
+
+    @property
+    def executed(self) -> bool:
+        return any(command.executed for command in self.commands)
+
+    def moves(self) -> list[MoveCommand]:
+        return self.commands
+
+
+# 可重试的错误，例如网络盘上文件被占用或连接超时
+TRANSIENT_ERRORS = (
+    PermissionError,
+    TimeoutError,
+    ConnectionError,
+    BlockingIOError,
+    InterruptedError,
+)
+
+
+class MoveExecutor:
+    """
+    在后台线程中执行已提交的移动命令
+
+    每次取出队列中已有的一批命令，目标目录只创建一次，瞬时错误按指数退避重试，
+    最终失败的命令通过 root.after 交给 UI 线程的 on_error(command, error) 处理。
+    call_after(func) 在之前提交的命令执行完后于后台线程中调用 func，不阻塞 UI 线程。
+    latency 不为 None 时记录每次移动的耗时。
+    """
+
+    def __init__(
+        self,
+        root,
+        on_error,
+        batch_size: int = 64,
+        retries: int = 3,
+        retry_delay: float = 0.2,
+        latency: LatencyRecorder | None = None,
+    ):
+        self.root = root
+        self.on_error = on_error
+        self.latency = latency
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.created_dirs = set()
+        self.queue = queue.Queue()
+        # 已提交、尚未执行完（成功或最终失败）的命令及其提交次数
+        self.inflight = Counter()
+        self.done = threading.Condition()
+        self.thread = threading.Thread(
+            target=self._run, name="move-executor", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, command: MoveCommand) -> None:
+        with self.done:
+            self.inflight[command] += 1
+        self.queue.put(command)
+
+    def call_after(self, func) -> None:
+        """之前提交的命令全部执行完后在后台线程中调用 func"""
+        self.queue.put(func)
+
+    def pending(self) -> int:
+        """尚未执行完的命令数"""
+        return self.queue.unfinished_tasks
+
+    def wait(self) -> None:
+        """阻塞直到已提交的命令全部执行完"""
+        self.queue.join()
+
+    def wait_for(self, commands) -> None:
+        """阻塞直到 commands 中已提交的命令执行完，不等待其他命令"""
+        with self.done:
+            self.done.wait_for(lambda: not any(c in self.inflight for c in commands))
+
+    def close(self, timeout: float | None = None) -> None:
+        """等待已提交的命令全部执行完后结束后台线程"""
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _run(self) -> None:
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            commands = []
+            try:
+                for item in batch:
+                    if isinstance(item, Command):
+                        commands.append(item)
+                        continue
+                    # 结束标记或 call_after 的回调：先执行完它之前的命令
+                    self._execute_batch(commands)
+                    commands = []
+                    if item is None:
+                        running = False
+                    else:
+                        self._call(item)
+                self._execute_batch(commands)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    @staticmethod
+    def _call(func) -> None:
         try:
-            shutil.move(str(src_path), str(dst_path))
+            func()
         except Exception as e:
-            print(f"移动文件失败: {e}")
+            logger.error(f"后台回调失败: {func}: {e}")
 
-    def undo(self):
-        if not self.src_dir.exists():
-            self.src_dir.mkdir(parents=True, exist_ok=True)
-        src_path = self.src_dir / self.filename
-        dst_path = self.dst_dir / self.filename
-        shutil.move(str(dst_path), str(src_path))
-        raise NotImplementedError("Move Commad `undo()` not implement!")
+    def _finish(self, command) -> None:
+        with self.done:
+            self.inflight[command] -= 1
+            if self.inflight[command] <= 0:
+                del self.inflight[command]
+            self.done.notify_all()
+
+    def _execute_batch(self, commands) -> None:
+        for dst_dir in {command.dst_dir for command in commands} - self.created_dirs:
+            command = next(c for c in commands if c.dst_dir == dst_dir)
+            try:
+                if command.op_log is not None and not dst_dir.exists():
+                    # 在源目录中新建目标目录会改变源目录的 mtime，记录下来
+                    command.op_log.change(
+                        "mkdir",
+                        command.src_dir,
+                        partial(dst_dir.mkdir, parents=True, exist_ok=True),
+                        dir=dst_dir.name,
+                    )
+                else:
+                    dst_dir.mkdir(parents=True, exist_ok=True)
+                self.created_dirs.add(dst_dir)
+            except OSError as e:
+                logger.error(f"创建目录失败: {dst_dir}: {e}")
+
+        for command in commands:
+            try:
+                self._execute(command)
+            finally:
+                self._finish(command)
+
+    def _execute(self, command) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                start = time.perf_counter()
+                command.execute(make_dirs=False)
+                if self.latency is not None:
+                    self.latency.record("move", time.perf_counter() - start)
+                return
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.retries:
+                    self.root.after(0, self.on_error, command, e)
+                else:
+                    time.sleep(self.retry_delay * 2**attempt)
+            except Exception as e:
+                self.root.after(0, self.on_error, command, e)
+                return
+
+
+class DirectoryScanner:
+    """
+    在后台线程中用 os.scandir 流式枚举目录中的图片
+
+    每批文件名排序后放入 batches 队列，批大小从 first_batch 开始倍增到 max_batch，
+    这样第一批很快就能显示，后续批次数量也不多；扫描结束时放入 None。
+    """
+
+    def __init__(self, directory, first_batch: int = 256, max_batch: int = 65536):
+        self.directory = directory
+        self.first_batch = first_batch
+        self.max_batch = max_batch
+        self.batches = queue.Queue()
+        self.stopped = False
+        self.thread = threading.Thread(
+            target=self._run, name="directory-scanner", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped = True
+
+    def _run(self) -> None:
+        batch = []
+        batch_size = self.first_batch
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if self.stopped:
+                        return
+                    if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    batch.append(entry.name)
+                    if len(batch) >= batch_size:
+                        batch.sort()
+                        self.batches.put(batch)
+                        batch = []
+                        batch_size = min(batch_size * 2, self.max_batch)
+        except OSError as e:
+            logger.error(f"扫描目录失败: {self.directory}: {e}")
+        finally:
+            if batch:
+                batch.sort()
+                self.batches.put(batch)
+            self.batches.put(None)
+
+
+class WorkItem:
+    """工作队列中的一个待分类文件夹，带有它自己的 相似/不相似 目标目录"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.similar_dir = self.directory / "相似"
+        self.dissimilar_dir = self.directory / "不相似"
+
+
+def discover_work_items(root) -> list[WorkItem]:
+    """
+    找出 root 下所有还有未分类图片的叶子文件夹
+
+    适用于 数据集 → sim* → 类别 → 图片 的目录结构，也兼容没有 sim 层级的数据集；
+    已分类的 相似/不相似 目录不会继续向下查找。
+    """
+    items = []
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in ("相似", "不相似"))
+        if any(name.lower().endswith(IMAGE_EXTENSIONS) for name in filenames):
+            items.append(WorkItem(directory))
+    return items
+
+
+def scan_images(directory) -> list[str]:
+    """一次性列出目录中的图片文件名（已排序），用于后台预扫描下一个文件夹"""
+    with os.scandir(directory) as entries:
+        return sorted(
+            entry.name
+            for entry in entries
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+
+
+def prescan_folder(directory) -> tuple:
+    """后台预扫描下一个文件夹，返回 (扫描前目录的 mtime, 图片列表)"""
+    mtime = mtime_ns(directory)
+    return mtime, scan_images(directory)
+
+
+class ImagePrefetcher:
+    """
+    在后台线程中预解码并缩放后续图片
+
+    结果以 (路径, 目标尺寸, 显示质量) 为键保存在按内存上限淘汰的 LRU 中，
+    切换图片时命中缓存即可直接写入显示缓冲区。后台线程解码前读取文件的修改时间并随结果保存，
+    get() 只 stat 要显示的图片，修改时间不同（文件被替换）时重新解码。
+    """
+
+    def __init__(
+        self,
+        lookahead: int = 4,
+        max_bytes: int = 256 * 1024 * 1024,
+        quality: str = "fast",
+        loader=load_display_image,
+    ):
+        self.lookahead = lookahead
+        self.quality = quality
+        # 解码函数，可替换为 ThumbnailCache.load_display_image
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.used_bytes = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, min(lookahead, 4)), thread_name_prefix="prefetch"
+        )
+
+    @staticmethod
+    def image_bytes(img: Image.Image) -> int:
+        return img.width * img.height * len(img.getbands())
+
+    def _load(self, key, timings=None):
+        """解码并放入缓存，返回 (图片, 解码前的修改时间)"""
+        try:
+            mtime = mtime_ns(key[0])
+            img = self.loader(*key, timings=timings)
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+        with self.lock:
+            self._put(key, img, mtime)
+        return img, mtime
+
+    def _put(self, key, img, mtime) -> None:
+        old = self.cache.pop(key, None)
+        if old is not None:
+            self.used_bytes -= self.image_bytes(old[0])
+        self.cache[key] = (img, mtime)
+        self.used_bytes += self.image_bytes(img)
+        # 超出内存上限时淘汰最久未使用的图片
+        while self.used_bytes > self.max_bytes and len(self.cache) > 1:
+            _, (old, _) = self.cache.popitem(last=False)
+            self.used_bytes -= self.image_bytes(old)
+
+    def get(self, path: str, size: tuple[int, int], timings=None) -> Image.Image:
+        """
+        获取缩放后的图片：命中缓存直接返回，正在预取则等待，否则同步解码
+
+        timings 不为 None 时累加同步解码/缩放的耗时，等待预取的时间计入 decode。
+        """
+        key = (path, size, self.quality)
+        mtime = mtime_ns(path)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry[1] == mtime:
+                self.cache.move_to_end(key)
+                return entry[0]
+            future = self.pending.get(key)
+        if future is not None:
+            start = time.perf_counter()
+            img, loaded = future.result()
+            if timings is not None:
+                waited = time.perf_counter() - start
+                timings["decode"] = timings.get("decode", 0.0) + waited
+            if loaded == mtime:
+                return img
+        return self._load(key, timings)[0]
+
+    def prefetch(self, paths, size: tuple[int, int], count: int | None = None) -> None:
+        """提交 paths 中前 count（默认 lookahead）张图片的预解码任务"""
+        with self.lock:
+            for path in islice(paths, count or self.lookahead):
+                key = (path, size, self.quality)
+                if key in self.cache or key in self.pending:
+                    continue
+                self.pending[key] = self.executor.submit(self._load, key)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 
 class ImageClassifierApp:
-    def __init__(self, root, max_buffer: int = 3):
+    def __init__(
+        self,
+        root,
+        max_buffer: int = 3,
+        lookahead: int = 4,
+        cache_mb: int = 256,
+        quality: str = "fast",
+        latency: bool = False,
+        latency_csv: str | None = None,
+        latency_overlay: bool = False,
+        thumb_cache: ThumbnailCache | None = None,
+        grid: tuple[int, int] = (3, 3),
+    ):
         self.root = root
+        self.thumb_cache = thumb_cache
         self.max_buffer = max_buffer
+        # 延迟统计：未开启时为 None，热路径上只有一次 None 判断
+        enabled = latency or latency_csv or latency_overlay
+        self.latency = LatencyRecorder() if enabled else None
+        self.latency_csv = latency_csv
+        self.latency_overlay = latency_overlay
+        loader = load_display_image
+        if thumb_cache is not None:
+            loader = thumb_cache.load_display_image
+        self.prefetcher = ImagePrefetcher(
+            lookahead, cache_mb * 1024 * 1024, quality, loader
+        )
+        self.executor = MoveExecutor(root, self.on_move_failed, latency=self.latency)
+        # 窗口尺寸变化的防抖：拖动过程中只在停止后重绘一次
+        self.resize_delay = 150
+        self.resize_job = None
+        self.rendered_size = None
         # Basic Info
         self.root.title("图片分类工具")
         self.root.geometry("900x700")
 
         # Bind Keyboard Event
-        self.root.bind("<s>", lambda event: self.move_image(True))  # 绑定 S 键
-        self.root.bind("<d>", lambda event: self.move_image(False))  # 绑定 D 键
-        self.root.bind("<z>", lambda event: self.undo_command())  # 绑定 Z 键
-        self.root.bind("<c>", lambda event: self.clear_queue())  # 绑定 C 键
+        self.bind_key("<s>", lambda: self.move_image(True))  # 绑定 S 键
+        self.bind_key("<d>", lambda: self.move_image(False))  # 绑定 D 键
+        self.bind_key("<z>", self.undo_command)  # 绑定 Z 键
+        self.bind_key("<c>", self.clear_queue)  # 绑定 C 键
+        self.bind_key("<q>", self.toggle_quality)  # 绑定 Q 键
+        self.bind_key("<g>", self.toggle_grid)  # 绑定 G 键
+        # 网格模式下数字键切换对应格子的例外标记
+        for number in range(1, 10):
+            self.bind_key(
+                f"<Key-{number}>", lambda index=number - 1: self.toggle_exception(index)
+            )
         # 绑定关闭事件
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
@@ -67,10 +459,51 @@ class ImageClassifierApp:
         self.similar_dir = None
         self.dissimilar_dir = None
         self.command_queue = deque(maxlen=max_buffer)
+        # 完整的标注历史（含已执行的命令），用于不受缓冲区大小限制的撤回
+        self.history = []
+        self.op_log = None
+        # 正在进行的目录扫描，已扫描到的文件名（用于写入快照），
+        # 以及从快照恢复时已在列表中、重新扫描时不再加入的文件名
+        self.scanner = None
+        self.scanned = []
+        self.scan_known = set()
+        # 工作队列模式：剩余的文件夹，以及在后台预扫描的下一个文件夹 (WorkItem, Future)
+        self.work_queue = deque()
+        self.next_folder = None
+        self.folder_loader = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="folder"
+        )
+        # 在后台查找数据集中的文件夹；期间又打开了其他目录时按代数丢弃结果
+        self.discover_generation = 0
+        # 网格模式：一页显示 grid_rows × grid_cols 张，例外的格子提交为相反的标注
+        self.grid_rows, self.grid_cols = grid
+        self.page_size = self.grid_rows * self.grid_cols
+        self.grid_mode = False
+        self.page_exceptions = set()
+        self.page = []
 
         # Create UI Widgets
         self.create_widgets()
 
+    def bind_key(self, sequence: str, action) -> None:
+        """绑定按键；开启延迟统计时记录从按键到界面重绘完成的耗时"""
+        if self.latency is None:
+            self.root.bind(sequence, lambda event: action())
+            return
+
+        def handler(event):
+            self.latency.begin(sequence)
+            action()
+            # 重绘同样在空闲时执行，排在它之后的回调即为绘制完成的时间点
+            self.root.after_idle(self.on_key_painted)
+
+        self.root.bind(sequence, handler)
+
+    def on_key_painted(self) -> None:
+        self.latency.end()
+        if self.latency_overlay:
+            self.latency_text.set(self.latency.summary())
+
     def create_widgets(self) -> None:
         # Top Frame
         top_frame = tk.Frame(self.root, pady=10)
@@ -79,11 +512,20 @@ class ImageClassifierApp:
         tk.Button(top_frame, text="打开文件夹", command=self.open_directory).pack(
             side=tk.LEFT, padx=5
         )
+        tk.Button(top_frame, text="打开数据集", command=self.open_work_root).pack(
+            side=tk.LEFT, padx=5
+        )
         ## Status Text
         self.status_text = tk.StringVar()
         tk.Label(top_frame, textvariable=self.status_text, fg="gray").pack(
             side=tk.RIGHT, padx=10
         )
+        ## Latency Overlay
+        self.latency_text = tk.StringVar()
+        if self.latency_overlay:
+            tk.Label(
+                top_frame, textvariable=self.latency_text, fg="gray", justify=tk.LEFT
+            ).pack(side=tk.LEFT, padx=10)
 
         # Middle Frame
         ## Image canvas
@@ -95,8 +537,34 @@ class ImageClassifierApp:
             side=tk.TOP, padx=10
         )
         ## Image Canvas
-        self.image_canvas = tk.Label(self.img_frame)
+        self.image_canvas = ImageSurface(self.img_frame, bg="#f0f0f0")
         self.image_canvas.pack(fill=tk.BOTH, expand=True)
+        self.img_frame.bind("<Configure>", self.on_frame_resize)
+        ## Thumbnail Grid（网格模式下替换 Image Canvas）
+        self.grid_frame = tk.Frame(self.img_frame, bg=GRID_BG)
+        self.grid_cells = []
+        for index in range(self.page_size):
+            cell = tk.Frame(self.grid_frame, bg=GRID_BG)
+            cell.grid(
+                row=index // self.grid_cols,
+                column=index % self.grid_cols,
+                sticky="nsew",
+                padx=2,
+                pady=2,
+            )
+            caption = tk.Label(cell, bg=GRID_BG, fg="gray")
+            caption.pack(side=tk.BOTTOM, fill=tk.X)
+            surface = ImageSurface(cell, bg=GRID_BG)
+            surface.pack(fill=tk.BOTH, expand=True)
+            for widget in (cell, caption, surface):
+                widget.bind(
+                    "<Button-1>", lambda event, i=index: self.toggle_exception(i)
+                )
+            self.grid_cells.append((cell, caption, surface))
+        for row in range(self.grid_rows):
+            self.grid_frame.rowconfigure(row, weight=1, uniform="row")
+        for column in range(self.grid_cols):
+            self.grid_frame.columnconfigure(column, weight=1, uniform="column")
 
         # Bottom Button Frame
         btn_frame = tk.Frame(self.root, pady=15)
@@ -156,31 +624,193 @@ class ImageClassifierApp:
         )
 
     def on_close(self) -> None:
+        # 等待移动完成期间忽略重复的关闭请求
+        self.root.protocol("WM_DELETE_WINDOW", lambda: None)
         self.clear_queue()
+        self.prefetcher.shutdown()
+        self.folder_loader.shutdown(wait=False, cancel_futures=True)
+        if self.scanner is not None:
+            self.scanner.stop()
+        self.update_buttons_state(tk.DISABLED)
+        self.root.unbind("<s>")
+        self.root.unbind("<d>")
+        # 显示剩余移动的进度，全部完成后再关闭窗口
+        self.close_progress = ttk.Progressbar(
+            self.root, mode="determinate", maximum=max(self.executor.pending(), 1)
+        )
+        self.close_progress.pack(fill=tk.X, padx=10, pady=5)
+        self.wait_for_moves()
+
+    def wait_for_moves(self) -> None:
+        pending = self.executor.pending()
+        if pending > 0:
+            self.status_text.set(f"正在完成剩余的移动: {pending}")
+            self.close_progress["value"] = self.close_progress["maximum"] - pending
+            self.root.after(100, self.wait_for_moves)
+            return
+        self.executor.close()
+        if self.op_log is not None:
+            self.op_log.close()
+        if self.thumb_cache is not None:
+            self.thumb_cache.close()
+        if self.latency is not None and self.latency_csv:
+            self.latency.dump_csv(self.latency_csv)
+            logger.info(f"latency:\n{self.latency.summary()}")
         self.root.destroy()
 
+    def on_move_failed(self, command: MoveCommand, error: Exception) -> None:
+        """后台移动失败时在 UI 线程中提示"""
+        # 标注已记录在日志中，下次打开该目录时会重新执行这次移动
+        logger.error(f"移动文件失败: {command.filename}: {error}")
+        self.status_text.set(
+            f"移动文件失败（下次打开时重试）: {command.filename}: {error}"
+        )
+
     # Button Event
     def open_directory(self) -> None:
         directory = filedialog.askdirectory(title="选择图片文件夹")
         if not directory:
             return
+        self.discover_generation += 1
+        self.work_queue.clear()
+        self.next_folder = None
+        self.load_directory(WorkItem(directory))
+
+    def open_work_root(self) -> None:
+        """选择数据集根目录，在后台查找其中所有还有未分类图片的文件夹后依次处理"""
+        root = filedialog.askdirectory(title="选择数据集根目录")
+        if not root:
+            return
+        self.discover_generation += 1
+        generation = self.discover_generation
+        self.status_text.set(f"正在查找未分类的文件夹…: {root}")
+        future = self.folder_loader.submit(discover_work_items, root)
+        future.add_done_callback(
+            lambda f: self.root.after(0, self.start_work_queue, root, f, generation)
+        )
+
+    def start_work_queue(self, root, future, generation) -> None:
+        if generation != self.discover_generation or future.cancelled():
+            return
+        if future.exception() is not None:
+            self.status_text.set(f"查找文件夹失败: {root}: {future.exception()}")
+            return
+        items = future.result()
+        if not items:
+            self.status_text.set(f"没有找到未分类的文件夹: {root}")
+            return
+        self.work_queue = deque(items)
+        self.next_folder = None
+        self.load_next_folder()
+
+    def load_next_folder(self) -> None:
+        """切换到工作队列中的下一个文件夹，并在后台预扫描再下一个"""
+        item = self.work_queue.popleft()
+        prescan = None
+        if self.next_folder is not None and self.next_folder[0] is item:
+            future = self.next_folder[1]
+            if future.exception() is None:
+                prescan = future.result()
+        self.next_folder = None
+        if self.work_queue:
+            following = self.work_queue[0]
+            self.next_folder = (
+                following,
+                self.folder_loader.submit(prescan_folder, following.directory),
+            )
+        self.load_directory(item, prescan)
+
+    def next_folder_paths(self) -> list[str]:
+        """已预扫描完成的下一个文件夹中的图片路径，用于提前解码"""
+        if self.next_folder is None:
+            return []
+        item, future = self.next_folder
+        if not future.done() or future.exception() is not None:
+            return []
+        return [str(item.directory / name) for name in future.result()[1]]
+
+    def load_directory(self, item: WorkItem, prescan: tuple | None = None) -> None:
+        """
+        切换到 item 对应的文件夹
 
-        directory = Path(directory)
+        prescan 为预扫描得到的 (mtime, 图片列表)；日志中的快照与目录的 mtime 一致时
+        以快照为准，否则以预扫描结果为准；两者都没有时在后台流式扫描。使用过期的快照时
+        先显示快照中的图片，同时在后台重新扫描，把之后新增的图片合并进来。
+        本程序自己的移动会刷新日志中的 mtime（见 OperationLog），不会使快照过期。
+        """
+        # 切换目录前提交上一个目录的待执行命令，这些命令执行完后由执行器关闭其日志
+        self.clear_queue()
+        if self.op_log is not None:
+            if self.op_log.path.parent == item.directory:
+                # 重新打开同一个目录：重放日志前要等之前的移动写完
+                self.executor.wait()
+                self.op_log.close()
+            else:
+                self.executor.call_after(self.op_log.close)
+
+        directory = item.directory
         self.current_dir = directory
-        self.similar_dir = directory / "相似"
-        self.dissimilar_dir = directory / "不相似"
-
-        # 获取所有支持的图片文件
-        all_images = [
-            f
-            for f in os.listdir(directory)
-            if f.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".bmp"))
-        ]
-        all_images.sort()
-        self.image_files.extend(all_images)
+        self.similar_dir = item.similar_dir
+        self.dissimilar_dir = item.dissimilar_dir
+
+        log_path = directory / OPERATION_LOG_NAME
+        state = OperationLog.replay(log_path)
+        self.op_log = OperationLog(log_path)
+        all_images, snapshot_mtime, history, moved = (
+            state if state is not None else (None, None, [], set())
+        )
+        self.restore_history(history, moved)
+        self.image_files = deque()
+        self.current_image = None
+        self.page_exceptions.clear()
+        if self.scanner is not None:
+            self.scanner.stop()
+            self.scanner = None
 
+        mtime = mtime_ns(directory)
+        stale = all_images is not None and snapshot_mtime != mtime
+        if prescan is not None and (all_images is None or stale):
+            # 预扫描的结果比快照新，从预扫描前的 mtime 开始跟踪
+            self.op_log.track(prescan[0])
+            all_images = prescan[1]
+            self.op_log.snapshot(all_images)
+            stale = False
+        elif all_images is not None and not stale:
+            self.op_log.track(mtime)
+
+        if all_images is None:
+            # 首次打开：在后台流式扫描目录，第一批到达后立即显示
+            self.update_buttons_state(tk.DISABLED)
+            self.start_scanner(directory, mtime, set())
+            self.status_text.set(f"0 已加载 / 扫描中…: {directory.name}")
+            return
+
+        # 从日志恢复：已标注的文件不再出现在待分类列表中
+        labeled = self.labeled_files()
+        self.image_files = deque(f for f in all_images if f not in labeled)
+        if stale:
+            # 快照之后目录有变化（例如新增了图片），在后台重新扫描并合并
+            self.start_scanner(directory, mtime, set(all_images))
+        self.show_first_image()
+
+    def start_scanner(self, directory, mtime, known: set[str]) -> None:
+        self.scanned = []
+        self.scan_known = known
+        # 扫描期间的移动照常刷新 mtime，扫描完成后随快照写入
+        self.op_log.track(mtime)
+        self.scanner = DirectoryScanner(directory)
+        self.root.after(20, self.poll_scanner, self.scanner)
+
+    def show_first_image(self) -> None:
+        """当前没有显示图片时，从待分类列表取出第一张显示"""
         if len(self.image_files) == 0:
-            self.status_text.set("目录中没有找到图片文件")
+            if self.scanner is None and self.work_queue:
+                # 工作队列模式：当前文件夹已没有待分类的图片
+                self.load_next_folder()
+                return
+            self.update_buttons_state(tk.DISABLED)
+            if self.scanner is None:
+                self.status_text.set("目录中没有找到图片文件")
             return
 
         self.update_buttons_state(tk.NORMAL)
@@ -188,108 +818,366 @@ class ImageClassifierApp:
         self.current_image = self.image_files.popleft()
         self.show_current_image()
 
-    def move_image(self, is_similar):
-        if self.current_image is None:
+    def poll_scanner(self, scanner: DirectoryScanner) -> None:
+        """在 UI 线程中合并已扫描到的批次，保持待分类列表有序"""
+        if scanner is not self.scanner:
+            # 已切换到其他目录
             return
+        batches = []
+        done = False
+        while True:
+            try:
+                batch = scanner.batches.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                done = True
+                break
+            batches.append(batch)
 
-        # 创建目录（如果需要）
-        target_dir = self.similar_dir if is_similar else self.dissimilar_dir
-        target_dir.mkdir(parents=True, exist_ok=True)
+        if batches:
+            for batch in batches:
+                self.scanned.extend(batch)
+            skip = self.labeled_files() | self.scan_known
+            batches = [[f for f in batch if f not in skip] for batch in batches]
+            self.image_files = deque(heapq.merge(self.image_files, *batches))
+        if done:
+            self.scanner = None
+            # 扫描完成后记录快照，目录没有变化时下次打开不再扫描
+            self.scanned.sort()
+            self.op_log.snapshot(self.scanned)
+            self.scanned = []
+            self.scan_known = set()
+        else:
+            self.root.after(50, self.poll_scanner, scanner)
 
-        # 移动文件
-        command = MoveCommand(
-            filename=self.current_image,
+        if self.current_image is None:
+            self.show_first_image()
+        elif self.grid_mode and batches and self.page_files() != self.page:
+            # 新扫描到的文件插入了当前页，重绘后再接受标注
+            self.page_exceptions.clear()
+            self.show_current_image()
+        elif batches or done:
+            self.update_status()
+
+    def new_command(self, filename: str, is_similar: bool) -> MoveCommand:
+        target_dir = self.similar_dir if is_similar else self.dissimilar_dir
+        return MoveCommand(
+            filename=filename,
             src_dir=str(self.current_dir),
             dst_dir=str(target_dir),
             is_similar=is_similar,
+            op_log=self.op_log,
+        )
+
+    def labeled_files(self) -> set[str]:
+        return {move.filename for command in self.history for move in command.moves()}
+
+    def restore_history(self, history, moved) -> None:
+        """
+        根据日志重建撤回历史，未执行的移动重新执行
+
+        完全没有执行的命令放回命令队列；部分执行的整页命令（中途崩溃或有移动失败）
+        把其中未执行的移动直接交给执行器。已经在目标目录中、只是没来得及记录的文件
+        补写 move 记录，不再重复移动。
+        """
+        self.history = []
+        self.command_queue.clear()
+        for labels in history:
+            commands = []
+            for filename, is_similar in labels:
+                command = self.new_command(filename, is_similar)
+                command.executed = filename in moved
+                if not command.executed and self.already_moved(command):
+                    command.executed = True
+                    self.op_log.append("move", file=filename)
+                commands.append(command)
+            if len(commands) == 1:
+                command = commands[0]
+            else:
+                # 整页提交的标注：按多数标注还原整页的标签（仅用于显示）
+                similar = sum(c.is_similar for c in commands) * 2 >= len(commands)
+                command = BatchCommand(commands, similar)
+            self.history.append(command)
+            pending = [move for move in command.moves() if not move.executed]
+            if len(pending) == len(command.moves()):
+                self.enqueue(command)
+            else:
+                for move in pending:
+                    self.executor.submit(move)
+
+    @staticmethod
+    def already_moved(command: MoveCommand) -> bool:
+        return (
+            not (command.src_dir / command.filename).exists()
+            and (command.dst_dir / command.filename).exists()
         )
+
+    def enqueue(self, command: Command) -> None:
+        """放入命令缓冲区，缓冲区已满时把最早的命令提交给后台执行器"""
         if len(self.command_queue) == self.max_buffer:
-            pop_command = self.command_queue.popleft()
-            pop_command.execute()
+            self.submit(self.command_queue.popleft())
         self.command_queue.append(command)
 
-        # 更新列表和索引
+    def submit(self, command: Command) -> None:
+        for move in command.moves():
+            self.executor.submit(move)
+
+    def move_image(self, is_similar):
+        if self.current_image is None:
+            return
+        if self.grid_mode:
+            self.commit_page(is_similar)
+            return
+
+        # 移动文件（目标目录由后台执行器在移动前创建）
+        command = self.new_command(self.current_image, is_similar)
+        self.op_log.append("label", file=command.filename, similar=is_similar)
+        self.history.append(command)
+        self.enqueue(command)
+
+        self.next_image()
+
+    def commit_page(self, is_similar: bool) -> None:
+        """网格模式：整页按 is_similar 提交，标记为例外的格子取相反的标注"""
+        files = self.page_files()
+        commands = [
+            self.new_command(filename, is_similar != (index in self.page_exceptions))
+            for index, filename in enumerate(files)
+        ]
+        command = BatchCommand(commands, is_similar)
+        self.op_log.append(
+            "label_batch", files=[[c.filename, c.is_similar] for c in commands]
+        )
+        self.history.append(command)
+        self.enqueue(command)
+
+        self.page_exceptions.clear()
+        for _ in range(len(files) - 1):
+            self.image_files.popleft()
+        self.next_image()
+
+    def next_image(self) -> None:
+        """当前图片已标注，显示下一张（或下一页）"""
         if len(self.image_files) > 0:
             self.current_image = self.image_files.popleft()
+        elif self.scanner is None and self.work_queue:
+            self.load_next_folder()
+            return
         else:
             self.current_image = None
             self.update_buttons_state(tk.DISABLED)
-            self.image_canvas.config(image=None)
-            self.status_text.set(f"分类完毕! {str(self.current_dir)}")
+            self.image_canvas.clear()
+            for index in range(self.page_size):
+                self.clear_cell(index)
+            if self.scanner is not None:
+                self.status_text.set(f"等待目录扫描…: {str(self.current_dir)}")
+            else:
+                self.status_text.set(f"分类完毕! {str(self.current_dir)}")
         self.show_current_image()
 
     def undo_command(self):
-        if len(self.command_queue) <= 0:
+        if len(self.history) <= 0:
             return
-        command = self.command_queue.pop()
-        self.image_files.appendleft(self.current_image)
-        self.current_image = command.filename
+        command = self.history[-1]
+        if len(self.command_queue) > 0 and self.command_queue[-1] is command:
+            # 还在缓冲区中，尚未移动
+            self.command_queue.pop()
+        else:
+            # 已提交执行：只等待这条命令执行完成，再把文件真正移回来
+            self.executor.wait_for(command.moves())
+            if command.executed:
+                try:
+                    command.undo()
+                except OSError as e:
+                    logger.error(f"撤回移动失败: {command.filename}: {e}")
+                    self.status_text.set(f"撤回移动失败: {command.filename}: {e}")
+                    return
+        self.history.pop()
+        files = [move.filename for move in command.moves()]
+        self.op_log.append("undo", file=files[0])
+
+        # 撤回的文件按原顺序放回待分类列表的最前面
+        if self.current_image is not None:
+            self.image_files.appendleft(self.current_image)
+        self.image_files.extendleft(reversed(files[1:]))
+        self.current_image = files[0]
+        self.page_exceptions.clear()
+        self.update_buttons_state(tk.NORMAL)
+        self.show_current_image()
+
+    def toggle_quality(self):
+        """在 fast 和 exact 两种显示质量之间切换，并重新显示当前图片"""
+        index = QUALITY_MODES.index(self.prefetcher.quality)
+        self.prefetcher.quality = QUALITY_MODES[(index + 1) % len(QUALITY_MODES)]
+        logger.info(f"display quality: {self.prefetcher.quality}")
         self.show_current_image()
 
     def clear_queue(self):
         if len(self.command_queue) <= 0:
             return
         while len(self.command_queue) > 0:
-            command = self.command_queue.pop()
-            command.execute()
+            command = self.command_queue.popleft()
+            self.submit(command)
+        self.show_current_image()
+
+    def toggle_grid(self):
+        """在单张模式和网格模式之间切换"""
+        self.grid_mode = not self.grid_mode
+        self.page_exceptions.clear()
+        if self.grid_mode:
+            self.image_canvas.pack_forget()
+            self.grid_frame.pack(fill=tk.BOTH, expand=True)
+        else:
+            self.grid_frame.pack_forget()
+            self.image_canvas.pack(fill=tk.BOTH, expand=True)
+        self.rendered_size = None
         self.show_current_image()
 
+    def toggle_exception(self, index: int):
+        """网格模式：切换第 index 个格子的例外标记"""
+        if not self.grid_mode or index >= len(self.page_files()):
+            return
+        self.page_exceptions ^= {index}
+        self.set_cell_bg(index)
+
+    def set_cell_bg(self, index: int) -> None:
+        bg = GRID_EXCEPTION_BG if index in self.page_exceptions else GRID_BG
+        for widget in self.grid_cells[index]:
+            widget.config(bg=bg)
+
+    def clear_cell(self, index: int) -> None:
+        _, caption, surface = self.grid_cells[index]
+        surface.clear()
+        caption.config(text="")
+        self.set_cell_bg(index)
+
+    def page_files(self) -> list[str]:
+        """网格模式下当前页的文件：当前图片及其后的 N×M-1 张"""
+        if self.current_image is None:
+            return []
+        return [self.current_image, *islice(self.image_files, self.page_size - 1)]
+
+    def on_frame_resize(self, event) -> None:
+        """图片区域尺寸变化时延迟重绘，连续的变化只触发最后一次"""
+        if self.resize_job is not None:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(self.resize_delay, self.on_resize_done)
+
+    def on_resize_done(self) -> None:
+        self.resize_job = None
+        size = (self.img_frame.winfo_width(), self.img_frame.winfo_height())
+        if size != self.rendered_size:
+            self.show_current_image()
+
     # Operations
     def show_current_image(self):
+        # 调试信息只在 DEBUG 级别生效时才会格式化
         logger.debug("===== [show current] =====")
-        logger.debug(f"img_files={list(self.image_files)[:5]}")
-        msg = ",".join(
-            [f"{com.filename}(sim-{com.is_similar})" for com in self.command_queue]
+        logger.opt(lazy=True).debug(
+            "img_files={}", lambda: list(islice(self.image_files, 5))
+        )
+        logger.opt(lazy=True).debug(
+            "queue=[{}]",
+            lambda: ",".join(
+                f"{com.filename}(sim-{com.is_similar})" for com in self.command_queue
+            ),
         )
-        logger.debug(f"queue=[{msg}]")
-        logger.debug(f"current_image={self.current_image}")
+        logger.debug("current_image={}", self.current_image)
         if self.current_image is None:
             return
-        # Queue Text
-        if len(self.command_queue) > 0:
-            queue_texts = [
-                f"{item.filename}({'相似' if item.is_similar else '不相似'})"
-                for item in self.command_queue
-            ]
-            self.queue_text.set(f"[{','.join(queue_texts)}]")
-        else:
-            self.queue_text.set("[]")
+        self.update_queue_text()
+        if self.grid_mode:
+            self.show_page()
+            return
         # Image Name
         self.image_name.set(self.current_image)
         img_path = self.current_dir / self.current_image
+        # 获取窗口的宽高
+        size = (self.img_frame.winfo_width(), self.img_frame.winfo_height())
         try:
-            # 加载图片并调整大小
-            img = Image.open(str(img_path))
-
-            # 获取窗口的宽高
-            window_width = self.img_frame.winfo_width()
-            window_height = self.img_frame.winfo_height()
-
-            # 调整图片大小以适应窗口
-            img_ratio = img.size[0] / img.size[1]
-            window_ratio = window_width / window_height
-
-            if img_ratio > window_ratio:
-                new_width = window_width
-                new_height = int(new_width / img_ratio)
+            # 优先从预取缓存获取已缩放的图片，再写入复用的显示缓冲区
+            if self.latency is None:
+                img = self.prefetcher.get(str(img_path), size)
+                self.image_canvas.show(img)
             else:
-                new_height = window_height
-                new_width = int(new_height * img_ratio)
-
-            img = img.resize((new_width, new_height), Image.LANCZOS)
-
-            # 显示图片
-            photo = ImageTk.PhotoImage(img)
-            self.image_canvas.config(image=photo)
-            self.image_canvas.image = photo
+                timings = self.latency.timings
+                img = self.prefetcher.get(str(img_path), size, timings)
+                start = time.perf_counter()
+                self.image_canvas.show(img)
+                self.latency.add("photo", time.perf_counter() - start)
+            self.rendered_size = size
 
         except Exception as e:
             logger.exception(f"Error loading image: {e}")
+        # 预取后续图片，当前文件夹快处理完时接着预取下一个文件夹的图片
+        paths = (str(self.current_dir / name) for name in self.image_files)
+        if len(self.image_files) < self.prefetcher.lookahead:
+            paths = chain(paths, self.next_folder_paths())
+        self.prefetcher.prefetch(paths, size)
         # 更新状态
+        self.update_status()
+
+    def show_page(self):
+        """网格模式：并行解码本页和下一页的缩略图，再依次填入格子"""
+        files = self.page = self.page_files()
+        size = (self.img_frame.winfo_width(), self.img_frame.winfo_height())
+        # 每个格子留出文件名和边距的空间
+        cell_size = (
+            max(size[0] // self.grid_cols - 8, 1),
+            max((size[1] - 30) // self.grid_rows - 28, 1),
+        )
+        paths = [str(self.current_dir / name) for name in files]
+        next_page = islice(self.image_files, self.page_size - 1, 2 * self.page_size - 1)
+        self.prefetcher.prefetch(
+            paths + [str(self.current_dir / name) for name in next_page],
+            cell_size,
+            count=2 * self.page_size,
+        )
+        self.image_name.set(f"{files[0]} … {files[-1]}（数字键/点击标记例外）")
+        timings = None if self.latency is None else self.latency.timings
+        for index, (_, caption, surface) in enumerate(self.grid_cells):
+            if index >= len(paths):
+                self.clear_cell(index)
+                continue
+            caption.config(text=f"{index + 1}. {files[index]}")
+            self.set_cell_bg(index)
+            try:
+                img = self.prefetcher.get(paths[index], cell_size, timings)
+                start = time.perf_counter()
+                surface.show(img)
+                if self.latency is not None:
+                    self.latency.add("photo", time.perf_counter() - start)
+            except Exception as e:
+                logger.exception(f"Error loading image: {e}")
+                surface.clear()
+        self.rendered_size = size
+        self.update_status()
+
+    def update_queue_text(self) -> None:
+        if len(self.command_queue) > 0:
+            queue_texts = [
+                f"{item.filename}({'相似' if item.is_similar else '不相似'})"
+                for item in self.command_queue
+            ]
+            self.queue_text.set(f"[{','.join(queue_texts)}]")
+        else:
+            self.queue_text.set("[]")
+
+    def update_status(self) -> None:
         total_image = len(self.image_files)
         if self.current_image:
             total_image += 1
-        self.status_text.set(f"{total_image}: {self.current_dir.name}")
+        if self.scanner is not None:
+            self.status_text.set(
+                f"{total_image} 已加载 / 扫描中…: {self.current_dir.name}"
+            )
+        else:
+            self.status_text.set(f"{total_image}: {self.current_dir.name}")
+        if self.work_queue:
+            self.status_text.set(
+                f"{self.status_text.get()}（还有 {len(self.work_queue)} 个文件夹）"
+            )
 
     def update_buttons_state(self, state):
         self.similar_btn.config(state=state)
@@ -297,6 +1185,66 @@ class ImageClassifierApp:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="图片相似分类工具（无侧边栏）")
+    parser.add_argument(
+        "--lookahead", type=int, default=4, help="预解码的后续图片数量（默认 4）"
+    )
+    parser.add_argument(
+        "--cache-mb", type=int, default=256, help="预解码缓存的内存上限 MB（默认 256）"
+    )
+    parser.add_argument(
+        "--quality",
+        choices=QUALITY_MODES,
+        default="fast",
+        help="显示质量：fast 低分辨率快速解码，exact 完整解码（默认 fast，Q 键切换）",
+    )
+    parser.add_argument(
+        "--latency", action="store_true", help="记录按键到绘制完成的延迟"
+    )
+    parser.add_argument(
+        "--latency-csv", help="退出时把延迟样本导出到该 CSV 文件（隐含 --latency）"
+    )
+    parser.add_argument(
+        "--latency-overlay",
+        action="store_true",
+        help="在窗口中显示延迟的 p50/p95/p99",
+    )
+    parser.add_argument(
+        "--thumb-cache-dir", default=str(DEFAULT_CACHE_DIR), help="缩略图缓存目录"
+    )
+    parser.add_argument(
+        "--thumb-cache-mb",
+        type=int,
+        default=2048,
+        help="缩略图缓存上限 MB（默认 2048）",
+    )
+    parser.add_argument(
+        "--no-thumb-cache", action="store_true", help="不使用持久化的缩略图缓存"
+    )
+    parser.add_argument(
+        "--grid",
+        default="3x3",
+        help="网格模式（G 键切换）每页的行数x列数，数字键只能标记前 9 格（默认 3x3）",
+    )
+    args = parser.parse_args()
+    grid = tuple(int(n) for n in args.grid.lower().split("x"))
+
+    thumb_cache = None
+    if not args.no_thumb_cache:
+        thumb_cache = ThumbnailCache(
+            args.thumb_cache_dir, args.thumb_cache_mb * 1024**2
+        )
+
     root = tk.Tk()
-    app = ImageClassifierApp(root)
+    app = ImageClassifierApp(
+        root,
+        lookahead=args.lookahead,
+        cache_mb=args.cache_mb,
+        quality=args.quality,
+        latency=args.latency,
+        latency_csv=args.latency_csv,
+        latency_overlay=args.latency_overlay,
+        thumb_cache=thumb_cache,
+        grid=grid,
+    )
     root.mainloop()
@@ -0,0 +1,247 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from abc import abstractmethod
+from pathlib import Path
+from loguru import logger
+
+# 每个标注目录下的操作日志文件名
+OPERATION_LOG_NAME = ".classifier_log.jsonl"
+
+# 快照记录的开头，重写日志时据此找出旧快照
+SNAPSHOT_PREFIX = '{"op": "open"'
+
+
+class Command:
+    @abstractmethod
+    def execute(): ...
+    @abstractmethod
+    def undo(): ...
+
+
+def mtime_ns(path):
+    """文件或目录的 mtime（ns），目录中增删文件时改变；无法访问时返回 None"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class OperationLog:
+    """
+    标注目录的只追加操作日志
+
+    每行一个 JSON 记录：
+    open: 打开时的图片列表快照及当时目录的 mtime，后续打开先直接使用快照，
+          mtime 变化时再在后台重新扫描，新增的图片合并进来；写入新快照时删除旧快照
+    label / undo: 标注和撤回，按顺序重放即可得到完整的撤回历史
+    label_batch: 网格模式下整页提交的一组标注，撤回时作为一个整体
+    move / restore: 文件真正被移入目标目录 / 被撤回移出目标目录
+    mkdir: 在目录中创建了目标目录
+    compact: 重写日志去掉了旧快照
+    move / restore / mkdir / compact 都会改变目录的 mtime。修改前目录的 mtime 与 self.mtime
+    一致（快照之后只有本程序改动过目录）时，记录中带上修改后的 mtime，重放时快照仍然有效。
+    写入后立即 flush，每 sync_every 条或关闭时 fsync 一次。
+    """
+
+    def __init__(self, path, sync_every: int = 32):
+        self.path = Path(path)
+        self.sync_every = sync_every
+        self.unsynced = 0
+        self.lock = threading.Lock()
+        # 追加句柄在日志的整个生命周期内保持打开，由 close() 关闭
+        self.file = open(self.path, "a", encoding="utf-8")  # noqa: SIM115
+        # 与快照一致时目录的 mtime（ns），未知或目录被其他程序改动过时为 None
+        self.mtime = None
+        self.change_lock = threading.Lock()
+
+    def append(self, op: str, **fields) -> None:
+        line = json.dumps({"op": op, **fields}, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every:
+                self._sync()
+
+    def _sync(self) -> None:
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def change(self, op: str, directory, func, **fields) -> None:
+        """
+        执行 func() 增删 directory 中的条目，成功后写入 op 记录
+
+        修改前目录的 mtime 与 self.mtime 一致时刷新 self.mtime 并写入记录，否则不再跟踪。
+        """
+        with self.change_lock:
+            self._change(op, directory, func, **fields)
+
+    def _change(self, op: str, directory, func, **fields) -> None:
+        tracked = self.mtime is not None and mtime_ns(directory) == self.mtime
+        try:
+            func()
+        finally:
+            self.mtime = mtime_ns(directory) if tracked else None
+        if self.mtime is not None:
+            fields["mtime"] = self.mtime
+        self.append(op, **fields)
+
+    def track(self, mtime) -> None:
+        """从 mtime（与快照或正在进行的扫描一致的目录 mtime）开始跟踪目录的变化"""
+        with self.change_lock:
+            self.mtime = mtime
+
+    def snapshot(self, files: list[str]) -> None:
+        """
+        写入目录的图片列表快照，带上当前跟踪的 mtime
+
+        日志中已有旧快照时重写日志删除它们，日志大小不随打开次数增长；替换日志文件
+        会改变目录的 mtime，之后追加一条 compact 记录带上新的 mtime。
+        """
+        with self.change_lock:
+            record = {"op": "open", "files": files, "mtime": self.mtime}
+            with self.lock:
+                self.file.flush()
+                with open(self.path, "r", encoding="utf-8") as f:
+                    lines = f.readlines()
+            if not any(line.startswith(SNAPSHOT_PREFIX) for line in lines):
+                self.append(**record)
+                return
+            line = json.dumps(record, ensure_ascii=False)
+            self._change(
+                "compact", self.path.parent, lambda: self._compact(lines, line)
+            )
+
+    def _compact(self, lines: list[str], snapshot: str) -> None:
+        """去掉旧快照并在末尾写入新快照，原子替换日志"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".log-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                # 崩溃时写了一半的行不再保留
+                f.writelines(
+                    line
+                    for line in lines
+                    if not line.startswith(SNAPSHOT_PREFIX) and line.endswith("\n")
+                )
+                f.write(snapshot + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            with self.lock:
+                os.replace(tmp_path, self.path)
+                # 换成新日志文件的追加句柄，仍由 close() 关闭
+                self.file.close()
+                self.file = open(self.path, "a", encoding="utf-8")  # noqa: SIM115
+                self.unsynced = 0
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def close(self) -> None:
+        with self.lock:
+            if self.unsynced:
+                self._sync()
+            self.file.close()
+
+    @staticmethod
+    def replay(path):
+        """
+        重放日志
+
+        返回 (files, mtime, history, moved)：图片列表快照（还没有快照时为 None）、
+        与快照一致的目录 mtime（ns，未知时为 None）、按顺序的标注历史、
+        已移动的文件名集合；日志不存在时返回 None。
+        标注历史的每一项是一次可撤回的操作，即 [(文件名, 是否相似), ...]，
+        单张标注只有一个元素。
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        files, mtime, history, moved = None, None, [], set()
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时可能只写了半行
+                    continue
+                op = record["op"]
+                if op == "open":
+                    files = record["files"]
+                    mtime = record.get("mtime")
+                elif op == "label":
+                    history.append([(record["file"], record["similar"])])
+                elif op == "label_batch":
+                    history.append([tuple(item) for item in record["files"]])
+                elif op == "undo":
+                    if history and history[-1][0][0] == record["file"]:
+                        history.pop()
+                elif op == "move":
+                    moved.add(record["file"])
+                    mtime = record.get("mtime")
+                elif op == "restore":
+                    moved.discard(record["file"])
+                    mtime = record.get("mtime")
+                elif op in ("mkdir", "compact"):
+                    mtime = record.get("mtime")
+        return files, mtime, history, moved
+
+
+class MoveCommand(Command):
+    def __init__(
+        self,
+        filename: str,
+        src_dir: str,
+        dst_dir: str,
+        is_similar: bool,
+        op_log: OperationLog | None = None,
+    ):
+        super().__init__()
+        self.filename = filename
+        self.is_similar = is_similar
+        self.src_dir = Path(src_dir)
+        self.dst_dir = Path(dst_dir)
+        self.op_log = op_log
+        self.executed = False
+
+    def execute(self, make_dirs: bool = True):
+        """移动文件，失败时抛出 OSError；make_dirs 为 False 时由调用方保证目标目录存在"""
+        logger.debug(f"execute: {self.filename}(sim-{self.is_similar})")
+        if make_dirs:
+            self.dst_dir.mkdir(parents=True, exist_ok=True)
+        src_path = self.src_dir / self.filename
+        dst_path = self.dst_dir / self.filename
+        if self.op_log is None:
+            shutil.move(str(src_path), str(dst_path))
+        else:
+            self.op_log.change(
+                "move",
+                self.src_dir,
+                lambda: shutil.move(str(src_path), str(dst_path)),
+                file=self.filename,
+            )
+        self.executed = True
+
+    def undo(self):
+        """把已移动的文件移回源目录"""
+        logger.debug(f"undo: {self.filename}(sim-{self.is_similar})")
+        if not self.src_dir.exists():
+            self.src_dir.mkdir(parents=True, exist_ok=True)
+        src_path = self.src_dir / self.filename
+        dst_path = self.dst_dir / self.filename
+        if self.op_log is None:
+            shutil.move(str(dst_path), str(src_path))
+        else:
+            self.op_log.change(
+                "restore",
+                self.src_dir,
+                lambda: shutil.move(str(dst_path), str(src_path)),
+                file=self.filename,
+            )
+        self.executed = False
+
+    def moves(self) -> list["MoveCommand"]:
+        return [self]
@@ -0,0 +1,123 @@
+import io
+import os
+import json
+import mmap
+import tarfile
+from pathlib import Path
+
+# 分片文件名格式，例如 broom-000012.tar
+SHARD_PATTERN = "{prefix}-{index:06d}.tar"
+# 每个类别的索引文件，每行一个成员：{"name", "shard", "offset", "size"}
+INDEX_SUFFIX = ".index.jsonl"
+
+
+def shard_prefix(category_name: str) -> str:
+    """类别名称转为分片文件名前缀（空格替换为下划线）"""
+    return category_name.replace(" ", "_")
+
+
+class ShardWriter:
+    """
+    将一个类别的图片流式写入大小受限的 tar 分片（WebDataset 风格）
+
+    每写入一个成员，就在索引中记录其数据在分片内的偏移和长度，读取时无需解包。
+    """
+
+    def __init__(self, output_dir, category_name: str, max_shard_size: int):
+        self.output_dir = Path(output_dir)
+        self.prefix = shard_prefix(category_name)
+        self.max_shard_size = max_shard_size
+        self.shard_index = -1
+        self.tar = None
+        self.shard_name = None
+        # 索引文件和当前分片在写入期间保持打开，由 close() 关闭
+        self.index_file = open(  # noqa: SIM115
+            self.output_dir / f"{self.prefix}{INDEX_SUFFIX}", "w", encoding="utf-8"
+        )
+
+    def _next_shard(self) -> None:
+        if self.tar is not None:
+            self.tar.close()
+        self.shard_index += 1
+        self.shard_name = SHARD_PATTERN.format(
+            prefix=self.prefix, index=self.shard_index
+        )
+        self.tar = tarfile.open(self.output_dir / self.shard_name, "w")  # noqa: SIM115
+
+    def add(self, path, arcname: str) -> int:
+        """写入一个文件，返回写入的字节数"""
+        size = os.path.getsize(path)
+        # 当前分片已有内容且写入后会超出上限时，切换到新分片
+        if self.tar is None or (
+            self.tar.offset > 0 and self.tar.offset + size > self.max_shard_size
+        ):
+            self._next_shard()
+
+        tarinfo = self.tar.gettarinfo(str(path), arcname=arcname)
+        header = tarinfo.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+        offset = self.tar.offset + len(header)
+        with open(path, "rb") as f:
+            self.tar.addfile(tarinfo, f)
+
+        record = {
+            "name": arcname,
+            "shard": self.shard_name,
+            "offset": offset,
+            "size": size,
+        }
+        self.index_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return size
+
+    def close(self) -> None:
+        if self.tar is not None:
+            self.tar.close()
+        self.index_file.close()
+
+
+class ShardReader:
+    """
+    按索引读取分片中的图片
+
+    分片通过 mmap 打开，读取某个成员只是对映射内存做一次切片，不会解包。
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = Path(archive_dir)
+        self.index = {}
+        self._maps = {}
+        for index_path in sorted(self.archive_dir.glob(f"*{INDEX_SUFFIX}")):
+            with open(index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    self.index[record["name"]] = (
+                        record["shard"],
+                        record["offset"],
+                        record["size"],
+                    )
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _map(self, shard: str) -> mmap.mmap:
+        if shard not in self._maps:
+            with open(self.archive_dir / shard, "rb") as f:
+                self._maps[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[shard]
+
+    def read(self, name: str) -> memoryview:
+        """返回成员内容的只读视图，名称不存在时抛出 KeyError"""
+        shard, offset, size = self.index[name]
+        return memoryview(self._map(shard))[offset : offset + size]
+
+    def open(self, name: str) -> io.BytesIO:
+        """以文件对象的形式返回成员内容，可直接交给 PIL.Image.open"""
+        return io.BytesIO(self.read(name))
+
+    def close(self) -> None:
+        """关闭所有映射，调用前需要先释放 read 返回的视图"""
+        for shard_map in self._maps.values():
+            shard_map.close()
+        self._maps.clear()
@@ -0,0 +1,448 @@
+import io
+import os
+import re
+import json
+import mmap
+import time
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from loguru import logger
+from image_utils import fit_size, load_display_image
+
+# 缓存的缩略图尺寸（最长边），显示时选择不小于目标尺寸的最小一档
+THUMB_SIZES = (256, 512, 1024, 2048)
+
+# 默认缓存目录，两个查看器共用
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "imageclassifier"
+
+# 支持的图片扩展名
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+
+# 打包文件名，整理后换用下一代的文件名：thumbs.pack、thumbs-1.pack、thumbs-2.pack……
+PACK_NAME = "thumbs.pack"
+PACK_PATTERN = "thumbs-{generation}.pack"
+INDEX_NAME = "thumbs.index.json"
+LOCK_NAME = "thumbs.lock"
+
+# 写入者每隔这么多秒把索引写回磁盘，进程被强制结束时最多丢失这段时间内的条目
+INDEX_SAVE_INTERVAL = 30.0
+
+
+def _try_lock(file) -> bool:
+    """对已打开的锁文件加非阻塞的排他锁，进程退出时由系统自动释放"""
+    try:
+        import fcntl
+
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except ImportError:
+        import msvcrt
+
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+    except OSError:
+        return False
+    return True
+
+
+def thumb_key(path, stat: os.stat_result, level: int) -> str:
+    """缓存键：由绝对路径、文件大小、mtime 和尺寸档位得到的摘要"""
+    raw = f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{level}"
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def thumb_level(box: tuple[int, int]):
+    """返回能覆盖 box 的最小尺寸档位，超出最大档位时返回 None"""
+    need = max(box)
+    for level in THUMB_SIZES:
+        if level >= need:
+            return level
+    return None
+
+
+class ThumbnailCache:
+    """
+    持久化的缩略图缓存
+
+    所有缩略图编码后追加到同一个打包文件中，读取时通过 mmap 定位；
+    索引记录所用的打包文件名和每个键的 (偏移, 长度, 最近使用时间)，定期及关闭时写回磁盘。
+    打包文件超过 max_bytes 时按最近使用时间淘汰，整理为下一代的打包文件，
+    再原子地替换索引，因此磁盘上的索引总是与它指向的打包文件一致。
+    定期保存索引和整理都由写入者的后台线程完成，锁内只复制索引和切换文件，
+    put() 不会因此阻塞调用线程（例如界面线程）。
+
+    同一个缓存目录可能同时被两个查看器和预热命令打开：第一个进程持有锁文件成为写入者，
+    之后的进程以只读方式打开，只读取打开时已写入的缩略图（在打开时映射索引指向的
+    打包文件，写入者之后追加或整理都不会改变已映射的内容），新生成的缩略图不写入缓存。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes: int = 2 * 1024**3):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.cache_dir / INDEX_NAME
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # 锁文件和打包文件的写入句柄在缓存的整个生命周期内保持打开，由 close() 关闭；
+        # 持有锁文件即持有写入权
+        self.lock_file = open(self.cache_dir / LOCK_NAME, "a+b")  # noqa: SIM115
+        self.lock_file.seek(0)
+        self.read_only = not _try_lock(self.lock_file)
+        self.writer = None
+        self.map = None
+        if self.read_only:
+            self.lock_file.close()
+            self.lock_file = None
+            self._open_reader()
+        else:
+            pack_name, entries = self._load_index()
+            self.pack_path = self.cache_dir / pack_name
+            self.writer = open(self.pack_path, "ab")  # noqa: SIM115
+            self.pack_size = self.writer.tell()
+            self.index = self._valid_entries(entries)
+            self._remove_old_packs()
+        self.dirty = False
+        self.saved_at = time.monotonic()
+        self.maintainer = None
+        if not self.read_only:
+            self.wakeup = threading.Event()
+            self.stopped = False
+            self.maintainer = threading.Thread(
+                target=self._maintain, name="thumb-cache", daemon=True
+            )
+            self.maintainer.start()
+
+    def _open_reader(self) -> None:
+        self.index = {}
+        self.pack_size = 0
+        # 读取索引和打开打包文件之间写入者可能刚好完成整理，重试一次
+        for _ in range(2):
+            pack_name, entries = self._load_index()
+            self.pack_path = self.cache_dir / pack_name
+            try:
+                with open(self.pack_path, "rb") as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        return
+                    self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                continue
+            self.pack_size = len(self.map)
+            self.index = self._valid_entries(entries)
+            return
+
+    def _load_index(self):
+        """返回 (打包文件名, 条目)"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return PACK_NAME, {}
+        if "entries" not in data:
+            # 旧格式：只有条目，对应 thumbs.pack
+            return PACK_NAME, data
+        return data["pack"], data["entries"]
+
+    def _valid_entries(self, entries) -> dict:
+        # 丢弃超出打包文件范围的记录（例如打包文件被截断）
+        return {
+            key: entry
+            for key, entry in entries.items()
+            if entry[0] + entry[1] <= self.pack_size
+        }
+
+    def _remove_old_packs(self) -> None:
+        """删除之前整理后遗留的打包文件（当时仍被只读进程打开而没能删除）"""
+        for path in self.cache_dir.glob("thumbs*.pack"):
+            if path != self.pack_path:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if self.read_only:
+            # 只读时只使用打开时的映射，索引中的条目都在其范围内
+            return self.map[offset : offset + length]
+        if self.map is None or offset + length > len(self.map):
+            # 打包文件增长后重新映射
+            if self.map is not None:
+                self.map.close()
+            self.writer.flush()
+            with open(self.pack_path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # 切片返回副本，整理打包文件时不会有残留的内存视图
+        return self.map[offset : offset + length]
+
+    def get(self, path, stat: os.stat_result, level: int):
+        """读取缓存的缩略图，未命中时返回 None"""
+        key = thumb_key(path, stat, level)
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            entry[2] = time.time()
+            self.dirty = True
+            data = self._read(entry[0], entry[1])
+        return Image.open(io.BytesIO(data))
+
+    def put(self, path, stat: os.stat_result, level: int, img: Image.Image) -> None:
+        """编码并追加一张缩略图，只读时不做任何事"""
+        if self.read_only:
+            return
+        buffer = io.BytesIO()
+        if img.mode not in ("RGB", "L", "RGBA", "LA", "P"):
+            img = img.convert("RGB")
+        if img.mode in ("RGB", "L"):
+            img.save(buffer, "JPEG", quality=90)
+        else:
+            img.save(buffer, "PNG")
+        data = buffer.getvalue()
+        key = thumb_key(path, stat, level)
+        with self.lock:
+            self.writer.write(data)
+            self.index[key] = [self.pack_size, len(data), time.time()]
+            self.pack_size += len(data)
+            self.dirty = True
+            due = (
+                self.pack_size > self.max_bytes
+                or time.monotonic() - self.saved_at > INDEX_SAVE_INTERVAL
+            )
+        if due:
+            self.wakeup.set()
+
+    def _maintain(self) -> None:
+        """后台线程：被 put() 唤醒后整理打包文件或保存索引"""
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            if self.stopped:
+                return
+            try:
+                if self.pack_size > self.max_bytes:
+                    self._evict()
+                else:
+                    self._save_index()
+            except OSError as e:
+                logger.error(f"缩略图缓存维护失败: {e}")
+                self.saved_at = time.monotonic()
+
+    def _evict(self) -> None:
+        """
+        按最近使用时间保留条目，直到占用不超过上限的 3/4，并整理打包文件
+
+        复制保留的条目时不持有锁，期间 put() 仍追加到旧的打包文件，
+        最后在锁内把这些新条目接到新的打包文件末尾并切换过去。
+        """
+        with self.lock:
+            self.writer.flush()
+            cut = self.pack_size
+            old_path = self.pack_path
+            entries = list(self.index.items())
+        budget = self.max_bytes * 3 // 4
+        kept = {}
+        used = 0
+        for key, entry in sorted(entries, key=lambda item: item[1][2], reverse=True):
+            if used + entry[1] > budget:
+                continue
+            kept[key] = entry
+            used += entry[1]
+
+        match = re.fullmatch(r"thumbs-(\d+)\.pack", old_path.name)
+        generation = int(match.group(1)) + 1 if match else 1
+        new_path = self.cache_dir / PACK_PATTERN.format(generation=generation)
+        new_index = {}
+        with open(old_path, "rb") as src:
+            with open(new_path, "wb") as out:
+                for key, (offset, length, last_used) in sorted(
+                    kept.items(), key=lambda item: item[1][0]
+                ):
+                    src.seek(offset)
+                    new_index[key] = [out.tell(), length, last_used]
+                    out.write(src.read(length))
+            with self.lock:
+                self.writer.flush()
+                src.seek(cut)
+                tail = src.read(self.pack_size - cut)
+                # 新的写入句柄由缓存持有，在 close() 或下一次整理时关闭
+                writer = open(new_path, "ab")  # noqa: SIM115
+                base = writer.tell()
+                writer.write(tail)
+                for key, entry in self.index.items():
+                    if entry[0] >= cut:
+                        new_index[key] = [base + entry[0] - cut, entry[1], entry[2]]
+                    elif key in new_index:
+                        # 整理期间被读取过的条目
+                        new_index[key][2] = entry[2]
+                if self.map is not None:
+                    self.map.close()
+                    self.map = None
+                self.writer.close()
+                self.writer = writer
+                self.pack_path = new_path
+                self.pack_size = writer.tell()
+                self.index = new_index
+                snapshot = self._snapshot()
+        # 先让索引指向新的打包文件，再删除旧的（只读进程仍可能映射着它）
+        self._write_index(snapshot)
+        try:
+            old_path.unlink()
+        except OSError:
+            pass
+
+    def _snapshot(self) -> dict:
+        """在锁内复制索引；条目中只有最近使用时间会被原地修改，可以在锁外序列化"""
+        # 索引中的条目必须已经落在打包文件中
+        self.writer.flush()
+        self.dirty = False
+        self.saved_at = time.monotonic()
+        return {"pack": self.pack_path.name, "entries": dict(self.index)}
+
+    def _save_index(self) -> None:
+        with self.lock:
+            snapshot = self._snapshot()
+        self._write_index(snapshot)
+
+    def _write_index(self, snapshot: dict) -> None:
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            self.dirty = True
+            raise
+
+    def load_display_image(
+        self,
+        path,
+        box: tuple[int, int],
+        quality: str = "fast",
+        upscale: bool = True,
+        timings: dict | None = None,
+    ) -> Image.Image:
+        """
+        与 image_utils.load_display_image 相同，但优先从缓存的缩略图缩放
+
+        exact 质量或目标尺寸超出最大档位时直接解码原图。
+        """
+        level = thumb_level(box)
+        if quality == "exact" or level is None:
+            return load_display_image(path, box, quality, upscale, timings)
+
+        start = time.perf_counter()
+        stat = os.stat(path)
+        thumb = self.get(path, stat, level)
+        if thumb is None:
+            thumb = load_display_image(path, (level, level), quality, False, timings)
+            self.put(path, stat, level, thumb)
+        else:
+            thumb.load()
+            if timings is not None:
+                seconds = time.perf_counter() - start
+                timings["decode"] = timings.get("decode", 0.0) + seconds
+
+        target = fit_size(thumb.size, box, upscale)
+        if target == thumb.size:
+            return thumb
+        start = time.perf_counter()
+        img = thumb.resize(target, Image.Resampling.BICUBIC)
+        if timings is not None:
+            seconds = time.perf_counter() - start
+            timings["resize"] = timings.get("resize", 0.0) + seconds
+        return img
+
+    def warm(self, root, levels=THUMB_SIZES, workers: int = 4) -> int:
+        """为目录树中的所有图片预先生成缩略图，返回新生成的图片数"""
+        paths = [
+            os.path.join(directory, name)
+            for directory, _, files in os.walk(root)
+            for name in files
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        levels = sorted(levels, reverse=True)
+
+        def warm_one(path) -> bool:
+            stat = os.stat(path)
+            missing = [
+                level
+                for level in levels
+                if thumb_key(path, stat, level) not in self.index
+            ]
+            if not missing:
+                return False
+            # 只解码一次，较小的档位由较大的缩略图继续缩小
+            img = load_display_image(path, (missing[0], missing[0]), upscale=False)
+            for level in missing:
+                img.thumbnail((level, level))
+                self.put(path, stat, level, img)
+            return True
+
+        created = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for index, result in enumerate(executor.map(warm_one, paths), 1):
+                created += result
+                if index % 1000 == 0:
+                    print(f"已处理 {index}/{len(paths)}")
+        return created
+
+    def close(self) -> None:
+        if self.maintainer is not None:
+            self.stopped = True
+            self.wakeup.set()
+            self.maintainer.join()
+            if self.dirty:
+                self._save_index()
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            if self.read_only:
+                return
+            self.writer.close()
+            self.lock_file.close()
+
+
+if __name__ == "__main__":
+    """
+    使用说明：
+        预先为目录树中的图片生成缩略图缓存，供 no_side.py 和 with_side.py 使用。
+        示例：`uv run thumb_cache.py "G:/path/to/dataset" -w 8`
+    """
+    parser = argparse.ArgumentParser(description="预热缩略图缓存")
+    parser.add_argument("directory", help="要预热的目录（递归处理）")
+    parser.add_argument("--cache-dir", default=str(DEFAULT_CACHE_DIR), help="缓存目录")
+    parser.add_argument(
+        "--max-mb", type=int, default=2048, help="缓存大小上限 MB（默认 2048）"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        choices=THUMB_SIZES,
+        default=list(THUMB_SIZES),
+        help="要生成的尺寸档位",
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=4, help="并行解码的线程数（默认 4）"
+    )
+    args = parser.parse_args()
+
+    cache = ThumbnailCache(args.cache_dir, args.max_mb * 1024 * 1024)
+    if cache.read_only:
+        cache.close()
+        raise SystemExit(
+            f"缓存目录正被其他进程写入（例如打开着的查看器）: {args.cache_dir}"
+        )
+    try:
+        start = time.perf_counter()
+        created = cache.warm(args.directory, args.sizes, args.workers)
+        print(
+            f"预热完成！新生成 {created} 张图片的缩略图，"
+            f"耗时 {time.perf_counter() - start:.1f} 秒"
+        )
+    finally:
+        cache.close()
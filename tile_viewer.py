@@ -0,0 +1,530 @@
+import math
+import threading
+import time
+import tkinter as tk
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageTk
+from image_utils import REDUCING_GAP, choose_filter
+
+# 小块的边长（层内像素）
+TILE_SIZE = 256
+
+# 最长边不超过该值的层整张加载（可命中缩略图缓存），更大的层按区域解码
+WHOLE_LEVEL_SIZE = 2048
+
+# 每次滚轮的缩放倍数和最大放大倍数（屏幕像素 / 原图像素）
+ZOOM_STEP = 1.25
+MAX_ZOOM = 8.0
+
+# 空闲 PhotoImage 的总像素数上限，约为一屏原始大小的小块；放大后的大块很快被淘汰
+PHOTO_POOL_PIXELS = 64 * TILE_SIZE * TILE_SIZE
+
+TILE_TAG = "tile"
+STALE_TAG = "stale"
+
+
+def _intersects(extents, box) -> bool:
+    return (
+        extents[0] < box[2]
+        and box[0] < extents[2]
+        and extents[1] < box[3]
+        and box[1] < extents[3]
+    )
+
+
+def _normalize(img: Image.Image) -> Image.Image:
+    """转换为可以插值缩放、PhotoImage 可直接显示的模式"""
+    if img.mode in ("RGB", "RGBA", "L"):
+        return img
+    return img.convert("RGBA" if img.has_transparency_data else "RGB")
+
+
+def _region_tiles(img: Image.Image, box):
+    """只解码 box 区域所需的 tile 列表，格式不支持按区域解码时返回 None"""
+    if len(img.tile) > 1:
+        # 分条或分块存储（如未压缩的 TIFF）：只保留与区域相交的条块
+        return [tile for tile in img.tile if _intersects(tile[1], box)]
+    if len(img.tile) != 1 or img.tile[0].codec_name != "raw":
+        return None
+    tile = img.tile[0]
+    if not isinstance(tile.args, tuple) or len(tile.args) != 3 or not tile.args[1]:
+        return None
+    # 未压缩的逐行数据（如 BMP）：跳过区域之外的行
+    left, top, right, bottom = tile.extents
+    stride, orientation = tile.args[1], tile.args[2]
+    first, last = max(box[1], top), min(box[3], bottom)
+    if orientation < 0:
+        # 自下而上存储，文件中的第一行是最下面一行
+        offset = tile.offset + (bottom - last) * stride
+    else:
+        offset = tile.offset + (first - top) * stride
+    return [tile._replace(extents=(left, first, right, last), offset=offset)]
+
+
+def decode_region(path, box, scale: int) -> Image.Image:
+    """
+    解码原图中 box（左, 上, 右, 下）区域并缩小为 1/scale
+
+    未压缩的逐行数据（如 BMP）只读取区域所在的行，分条或分块存储的格式（如 TIFF）
+    只解码与区域相交的条块；JPEG 通过 draft 直接以 1/2、1/4、1/8 的分辨率解码；
+    其他格式只能解码整张后裁剪。
+    """
+    left, top, right, bottom = box
+    size = (math.ceil((right - left) / scale), math.ceil((bottom - top) / scale))
+    with Image.open(path) as img:
+        full_width = img.width
+        tiles = _region_tiles(img, box)
+        if tiles:
+            img.tile = tiles
+        elif scale > 1:
+            # 仅对 JPEG 生效，解码时的尺寸不会小于原图的 1/scale
+            img.draft(img.mode, (img.width // scale, img.height // scale))
+        img.load()
+        ratio = img.width / full_width
+        region = img.crop(tuple(round(value * ratio) for value in box))
+    region = _normalize(region)
+    if region.size != size:
+        region = region.resize(
+            size, choose_filter(region.size, size), reducing_gap=REDUCING_GAP
+        )
+    return region
+
+
+class ImagePyramid:
+    """
+    按需构建的图片金字塔
+
+    第 k 层为原图的 1/2^k，切分为 TILE_SIZE 的小块。不超过 WHOLE_LEVEL_SIZE 的缩小层
+    通过 load_image（可命中缩略图缓存）整张加载，第 0 层总是从原图解码；更大的层只解码需要的小块，能按区域解码的格式只解码
+    这些小块所在的区域，否则整张解码后按缓存容量切出离请求最近的小块，不保留整张原图。
+    解码结果放在按字节数淘汰的 LRU 缓存中。tiles() 持有锁，可以同时在界面线程和解码线程中调用。
+    """
+
+    def __init__(
+        self, path, load_image, quality="fast", cache_bytes: int = 256 * 1024**2
+    ):
+        self.path = path
+        self.load_image = load_image
+        self.quality = quality
+        with Image.open(path) as img:
+            self.size = img.size
+            self.regional = _region_tiles(img, (0, 0) + img.size) is not None
+        # 最顶层放得进一个小块
+        self.levels = max(0, math.ceil(math.log2(max(self.size) / TILE_SIZE)))
+        self.cache = OrderedDict()
+        self.cache_bytes = cache_bytes
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def level_for(self, zoom: float) -> int:
+        """不低于显示分辨率的最粗一层"""
+        if zoom >= 1.0:
+            return 0
+        return min(int(math.log2(1.0 / zoom)), self.levels)
+
+    def level_size(self, level: int) -> tuple[int, int]:
+        scale = 2**level
+        return math.ceil(self.size[0] / scale), math.ceil(self.size[1] / scale)
+
+    def grid(self, level: int) -> tuple[int, int]:
+        width, height = self.level_size(level)
+        return math.ceil(width / TILE_SIZE), math.ceil(height / TILE_SIZE)
+
+    def tile_box(self, level: int, col: int, row: int) -> tuple[int, int, int, int]:
+        """小块在该层中的范围"""
+        width, height = self.level_size(level)
+        left, top = col * TILE_SIZE, row * TILE_SIZE
+        return left, top, min(left + TILE_SIZE, width), min(top + TILE_SIZE, height)
+
+    def _get(self, key):
+        img = self.cache.get(key)
+        if img is not None:
+            self.cache.move_to_end(key)
+        return img
+
+    def _put(self, key, img: Image.Image) -> None:
+        self.cache[key] = img
+        self.used += img.width * img.height * len(img.getbands())
+        while self.used > self.cache_bytes and len(self.cache) > 1:
+            _, old = self.cache.popitem(last=False)
+            self.used -= old.width * old.height * len(old.getbands())
+
+    def _whole_level(self, level: int, timings=None) -> Image.Image:
+        img = self._get((level,))
+        if img is None and level == 0:
+            # 原始分辨率（缩放不小于 1/2）直接解码原图，不使用缩略图缓存中重新压缩过的图片
+            start = time.perf_counter()
+            img = decode_region(self.path, (0, 0) + self.size, 1)
+            if timings is not None:
+                seconds = time.perf_counter() - start
+                timings["decode"] = timings.get("decode", 0.0) + seconds
+            self._put((level,), img)
+        elif img is None:
+            size = self.level_size(level)
+            img = self.load_image(self.path, size, self.quality, False, timings)
+            img = _normalize(img)
+            if img.size != size:
+                # 缩略图缓存取整的方式不同，可能差一个像素
+                img = img.resize(size, Image.Resampling.BILINEAR)
+            self._put((level,), img)
+        return img
+
+    def tiles(self, level: int, keys, timings=None) -> dict:
+        """返回第 level 层中 keys（(列, 行)）对应的小块，缺少的小块一次解码"""
+        width, height = self.level_size(level)
+        with self.lock:
+            if max(width, height) <= WHOLE_LEVEL_SIZE:
+                img = self._whole_level(level, timings)
+                return {key: img.crop(self.tile_box(level, *key)) for key in keys}
+
+            found = {key: self._get((level,) + key) for key in keys}
+            missing = [key for key, img in found.items() if img is None]
+            if missing:
+                found.update(self._decode(level, missing))
+            return found
+
+    def _decode(self, level: int, missing) -> dict:
+        scale = 2**level
+        if self.regional:
+            boxes = [self.tile_box(level, *key) for key in missing]
+            region = (
+                min(box[0] for box in boxes),
+                min(box[1] for box in boxes),
+                max(box[2] for box in boxes),
+                max(box[3] for box in boxes),
+            )
+            keys = missing
+        else:
+            # 无论如何都要解码整张，顺便切出请求附近的小块，直到用掉一半缓存
+            width, height = self.level_size(level)
+            region = (0, 0, width, height)
+            cols, rows = self.grid(level)
+            center_col = sum(col for col, _ in missing) / len(missing)
+            center_row = sum(row for _, row in missing) / len(missing)
+            nearby = sorted(
+                (
+                    (col, row)
+                    for col in range(cols)
+                    for row in range(rows)
+                    if (level, col, row) not in self.cache
+                ),
+                key=lambda key: (key[0] - center_col) ** 2 + (key[1] - center_row) ** 2,
+            )
+            budget = self.cache_bytes // 2 // (TILE_SIZE * TILE_SIZE * 4)
+            keys = set(missing)
+            keys.update(nearby[: max(budget - len(keys), 0)])
+        source_box = tuple(
+            min(value * scale, limit)
+            for value, limit in zip(region, self.size + self.size)
+        )
+        img = decode_region(self.path, source_box, scale)
+        decoded = {}
+        # 请求的小块最后放入，最不容易被淘汰
+        for key in sorted(keys, key=lambda key: key in missing):
+            left, top, right, bottom = self.tile_box(level, *key)
+            decoded[key] = img.crop(
+                (
+                    left - region[0],
+                    top - region[1],
+                    right - region[0],
+                    bottom - region[1],
+                )
+            )
+            self._put((level,) + key, decoded[key])
+        return {key: decoded[key] for key in missing}
+
+
+def render_tiles(pyramid: ImagePyramid, level: int, keys, factor: float, timings=None):
+    """
+    取出小块并缩放到屏幕尺寸
+
+    返回 [(列, 行, x, y, 图片)]，x、y 为相对图片左上角的屏幕坐标；
+    小块的边界按同一比例取整，相邻小块之间没有缝隙。
+    """
+    rendered = []
+    for (col, row), tile in pyramid.tiles(level, keys, timings).items():
+        left, top, right, bottom = pyramid.tile_box(level, col, row)
+        x, y = round(left * factor), round(top * factor)
+        size = (max(round(right * factor) - x, 1), max(round(bottom * factor) - y, 1))
+        if size != tile.size:
+            tile = tile.resize(size, choose_filter(tile.size, size))
+        rendered.append((col, row, x, y, tile))
+    return rendered
+
+
+class TileViewer(tk.Canvas):
+    """
+    可缩放、拖动的图片显示区域
+
+    图片按 ImagePyramid 分层分块显示：滚轮以指针为中心缩放，拖动平移，双击恢复适应窗口。
+    只有切换图片后的第一次绘制在调用线程中同步进行；之后的缩放、平移和重新适应窗口
+    都在后台线程中解码可见区域及周围一圈的小块，旧的图片项保留到新的小块绘制完成，避免闪烁。
+    移除的小块的 PhotoImage 按 (模式, 尺寸) 放回池中，之后同样尺寸的小块 paste() 复用。
+    """
+
+    def __init__(self, master, load_image, on_zoom=None, **kwargs):
+        kwargs.setdefault("highlightthickness", 0)
+        super().__init__(master, **kwargs)
+        self.load_image = load_image
+        self.on_zoom = on_zoom
+        self.pyramid = None
+        self.zoom = 1.0
+        # 是否处于适应窗口的缩放，此时窗口大小改变会重新适应
+        self.fit = True
+        # 图片左上角在画布上的坐标
+        self.origin = (0, 0)
+        # 当前绘制的 (层, 缩放) 及其小块 {(列, 行): (图片项, PhotoImage, 池中的键)}
+        self.view = None
+        self.items = {}
+        self.stale = []
+        self.pending = set()
+        # 空闲的 [(池中的键, PhotoImage)] 及其总像素数，超出上限时丢弃最早放回的
+        self.photos = deque()
+        self.pool_pixels = 0
+        # 切换图片或缩放后，之前提交的解码结果按代数丢弃
+        self.generation = 0
+        self.update_job = None
+        self.drag_start = None
+        self.decoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tiles")
+
+        self.bind("<Configure>", self.on_configure)
+        self.bind("<ButtonPress-1>", self.on_press)
+        self.bind("<B1-Motion>", self.on_drag)
+        self.bind("<Double-Button-1>", lambda event: self.fit_view())
+        self.bind("<MouseWheel>", self.on_wheel)
+        self.bind("<Button-4>", self.on_wheel)
+        self.bind("<Button-5>", self.on_wheel)
+
+    def show(self, path, quality="fast", timings=None) -> tuple[int, int]:
+        """显示新图片（适应窗口），返回原图尺寸"""
+        self.pyramid = ImagePyramid(path, self.load_image, quality)
+        self.reset()
+        self.fit_view(timings, sync=True)
+        return self.pyramid.size
+
+    def clear(self) -> None:
+        self.pyramid = None
+        self.reset()
+
+    def close(self) -> None:
+        self.decoder.shutdown(wait=False, cancel_futures=True)
+
+    def reset(self) -> None:
+        self.delete(tk.ALL)
+        for _, photo, key in self.items.values():
+            self.release_photo(photo, key)
+        for photo, key in self.stale:
+            self.release_photo(photo, key)
+        self.items = {}
+        self.stale = []
+        self.pending = set()
+        self.view = None
+        self.generation += 1
+
+    def canvas_size(self) -> tuple[int, int]:
+        return max(self.winfo_width(), 1), max(self.winfo_height(), 1)
+
+    def fit_view(self, timings=None, sync: bool = False) -> None:
+        if self.pyramid is None:
+            return
+        width, height = self.canvas_size()
+        # 与之前一样不放大小图
+        self.zoom = min(
+            width / self.pyramid.size[0], height / self.pyramid.size[1], 1.0
+        )
+        self.fit = True
+        self.clamp()
+        if sync:
+            self.update_tiles(sync=True, timings=timings)
+        else:
+            self.schedule_update()
+        if self.on_zoom is not None:
+            self.on_zoom(self.zoom)
+
+    def zoom_by(self, factor: float, x=None, y=None) -> None:
+        """以画布坐标 (x, y)（默认中心）为中心缩放"""
+        if self.pyramid is None:
+            return
+        width, height = self.canvas_size()
+        fit = min(width / self.pyramid.size[0], height / self.pyramid.size[1], 1.0)
+        zoom = min(max(self.zoom * factor, fit), MAX_ZOOM)
+        if zoom == self.zoom:
+            return
+        if zoom == fit:
+            self.fit_view()
+            return
+        x = width / 2 if x is None else x
+        y = height / 2 if y is None else y
+        ratio = zoom / self.zoom
+        self.origin = (
+            round(x - (x - self.origin[0]) * ratio),
+            round(y - (y - self.origin[1]) * ratio),
+        )
+        self.zoom = zoom
+        self.fit = False
+        self.clamp()
+        self.schedule_update()
+        if self.on_zoom is not None:
+            self.on_zoom(self.zoom)
+
+    def clamp(self) -> None:
+        """比画布小的方向居中，比画布大的方向不留出空白"""
+        width, height = self.canvas_size()
+        origin = []
+        for offset, view, size in zip(self.origin, (width, height), self.pyramid.size):
+            shown = round(size * self.zoom)
+            if shown <= view:
+                origin.append((view - shown) // 2)
+            else:
+                origin.append(min(0, max(offset, view - shown)))
+        dx, dy = origin[0] - self.origin[0], origin[1] - self.origin[1]
+        self.origin = tuple(origin)
+        if dx or dy:
+            self.move(tk.ALL, dx, dy)
+
+    def on_configure(self, event) -> None:
+        if self.pyramid is None:
+            return
+        if self.fit:
+            self.fit_view()
+        else:
+            self.clamp()
+            self.schedule_update()
+
+    def on_press(self, event) -> None:
+        self.drag_start = (event.x, event.y)
+
+    def on_drag(self, event) -> None:
+        if self.pyramid is None or self.drag_start is None:
+            return
+        x, y = self.origin
+        self.move(tk.ALL, event.x - self.drag_start[0], event.y - self.drag_start[1])
+        self.origin = (
+            x + event.x - self.drag_start[0],
+            y + event.y - self.drag_start[1],
+        )
+        self.drag_start = (event.x, event.y)
+        self.clamp()
+        self.schedule_update()
+
+    def on_wheel(self, event) -> None:
+        # Windows/macOS 使用 delta，X11 使用按钮 4/5
+        up = event.num == 4 or getattr(event, "delta", 0) > 0
+        self.zoom_by(ZOOM_STEP if up else 1 / ZOOM_STEP, event.x, event.y)
+
+    def schedule_update(self) -> None:
+        """拖动和连续滚动时合并为每帧一次"""
+        if self.update_job is None:
+            self.update_job = self.after(16, self.update_tiles)
+
+    def update_tiles(self, sync: bool = False, timings=None) -> None:
+        self.update_job = None
+        if self.pyramid is None:
+            return
+        pyramid = self.pyramid
+        level = pyramid.level_for(self.zoom)
+        factor = self.zoom * pyramid.size[0] / pyramid.level_size(level)[0]
+        view = (level, self.zoom)
+        if view != self.view:
+            # 旧的小块留在画布上，新的小块绘制完成后再删除
+            for item, photo, key in self.items.values():
+                self.itemconfig(item, tags=STALE_TAG)
+                self.stale.append((photo, key))
+            self.items = {}
+            self.pending = set()
+            self.view = view
+            self.generation += 1
+
+        # 可见范围外再多取一圈，平移时不必等待
+        step = TILE_SIZE * factor
+        width, height = self.canvas_size()
+        cols, rows = pyramid.grid(level)
+        first_col = max(int(-self.origin[0] // step) - 1, 0)
+        last_col = min(int((width - self.origin[0]) // step) + 1, cols - 1)
+        first_row = max(int(-self.origin[1] // step) - 1, 0)
+        last_row = min(int((height - self.origin[1]) // step) + 1, rows - 1)
+        wanted = {
+            (col, row)
+            for col in range(first_col, last_col + 1)
+            for row in range(first_row, last_row + 1)
+        }
+        for key in [key for key in self.items if key not in wanted]:
+            item, photo, pool_key = self.items.pop(key)
+            self.delete(item)
+            self.release_photo(photo, pool_key)
+
+        center = (
+            (width / 2 - self.origin[0]) / step,
+            (height / 2 - self.origin[1]) / step,
+        )
+        missing = sorted(
+            wanted - self.items.keys() - self.pending,
+            key=lambda key: (
+                (key[0] + 0.5 - center[0]) ** 2 + (key[1] + 0.5 - center[1]) ** 2
+            ),
+        )
+        if not missing:
+            if not self.pending:
+                self.drop_stale()
+            return
+        generation = self.generation
+        if sync:
+            self.place_tiles(
+                generation, render_tiles(pyramid, level, missing, factor, timings)
+            )
+            return
+        self.pending.update(missing)
+        future = self.decoder.submit(render_tiles, pyramid, level, missing, factor)
+
+        def done(f):
+            # 解码失败（例如文件已被移走）时不再绘制
+            if f.exception() is None:
+                self.after(0, self.place_tiles, generation, f.result())
+
+        future.add_done_callback(done)
+
+    def place_tiles(self, generation, rendered) -> None:
+        if generation != self.generation:
+            return
+        for col, row, x, y, tile in rendered:
+            self.pending.discard((col, row))
+            if (col, row) in self.items:
+                continue
+            pool_key = (tile.mode, tile.size)
+            photo = self.acquire_photo(pool_key)
+            photo.paste(tile)
+            item = self.create_image(
+                self.origin[0] + x,
+                self.origin[1] + y,
+                image=photo,
+                anchor=tk.NW,
+                tags=TILE_TAG,
+            )
+            self.items[(col, row)] = (item, photo, pool_key)
+        if not self.pending:
+            self.drop_stale()
+
+    def acquire_photo(self, key) -> ImageTk.PhotoImage:
+        """从池中取出模式和尺寸相同的 PhotoImage，没有时新建"""
+        for index, (pool_key, photo) in enumerate(self.photos):
+            if pool_key == key:
+                del self.photos[index]
+                self.pool_pixels -= key[1][0] * key[1][1]
+                return photo
+        return ImageTk.PhotoImage(*key)
+
+    def release_photo(self, photo, key) -> None:
+        """图片项删除后放回池中；paste() 会覆盖整个缓冲区，不需要清空"""
+        self.photos.append((key, photo))
+        self.pool_pixels += key[1][0] * key[1][1]
+        while self.pool_pixels > PHOTO_POOL_PIXELS:
+            (_, (width, height)), _ = self.photos.popleft()
+            self.pool_pixels -= width * height
+
+    def drop_stale(self) -> None:
+        if self.stale:
+            self.delete(STALE_TAG)
+            for photo, key in self.stale:
+                self.release_photo(photo, key)
+            self.stale = []
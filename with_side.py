@@ -1,37 +1,273 @@
 import os
 import tkinter as tk
 from tkinter import filedialog, ttk
-from PIL import Image, ImageTk
+from dir_watcher import watch_directory
+from image_utils import QUALITY_MODES, load_display_image
+from latency import LatencyRecorder
+from thumb_cache import DEFAULT_CACHE_DIR, ThumbnailCache
+from tile_viewer import ZOOM_STEP, TileViewer
+import argparse
+import bisect
+import fnmatch
+import re
 import shutil
-import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 支持的图片扩展名
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+
+
+class DirNode:
+    """
+    目录树模型中的一个目录：Treeview 节点 ID、排好序的子目录名和图片名、项目数
+
+    listed 表示已枚举过（dirs/images/count 有效），loaded 表示子节点已全部插入 Treeview；
+    未加载的目录下只有一个占位子节点，用于显示展开标记。
+    """
+
+    def __init__(self, item):
+        self.item = item
+        self.dirs = []
+        self.images = []
+        self.count = 0
+        self.listed = False
+        self.loaded = False
+        self.placeholder = None
+        # 正在分片插入子节点；期间对该目录的增量修改暂存在 deferred 中，插入完成后再执行
+        self.populating = False
+        self.deferred = []
+
+
+class UiScheduler:
+    """
+    Tk 线程中的分片任务调度器
+
+    request(key, func) 合并同一 key 尚未执行的重复请求，只执行最后一次；
+    add(task) 加入一个生成器任务，每次 next() 执行一小步界面修改。
+    所有工作都在 after() 回调中执行，每次最多占用 budget_ms 毫秒，
+    超出后让出给输入事件和重绘，多个任务轮流推进。
+    """
+
+    def __init__(self, root, budget_ms: float = 8):
+        self.root = root
+        self.budget = budget_ms / 1000
+        self.requests = {}
+        self.tasks = deque()
+        self.job = None
+
+    def request(self, key, func) -> None:
+        self.requests[key] = func
+        self._wake()
+
+    def add(self, task) -> None:
+        self.tasks.append(task)
+        self._wake()
+
+    def clear(self) -> None:
+        self.requests.clear()
+        self.tasks.clear()
+
+    def _wake(self) -> None:
+        if self.job is None:
+            self.job = self.root.after(1, self._run)
+
+    def _run(self) -> None:
+        self.job = None
+        deadline = time.perf_counter() + self.budget
+        while time.perf_counter() < deadline:
+            if self.requests:
+                key = next(iter(self.requests))
+                self.requests.pop(key)()
+            elif self.tasks:
+                task = self.tasks.popleft()
+                try:
+                    next(task)
+                except StopIteration:
+                    continue
+                self.tasks.append(task)
+            else:
+                return
+        self._wake()
+
+
+def list_directory(path):
+    """用一次 scandir 枚举一层目录，返回 (项目数, 子目录名, 图片名)，失败时返回 None"""
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return None
+    dirs = sorted(
+        entry.name
+        for entry in entries
+        if entry.is_dir() and not entry.name.startswith(".")
+    )
+    images = sorted(
+        entry.name
+        for entry in entries
+        if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return len(entries), dirs, images
+
+
+def walk_names(root):
+    """在后台线程中枚举整个目录树，返回按路径排序的 {路径: 小写名称}（目录和图片）"""
+    index = {}
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        if not entry.name.startswith("."):
+                            index[entry.path] = entry.name.lower()
+                            stack.append(entry.path)
+                    elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        index[entry.path] = entry.name.lower()
+        except OSError:
+            continue
+    return dict(sorted(index.items()))
+
+
+def is_glob(query):
+    return any(char in query for char in "*?[")
+
+
+def compile_query(query):
+    """把查询编译为匹配函数：通配查询匹配整个名称，否则匹配名称中的子串"""
+    if is_glob(query):
+        return re.compile(fnmatch.translate(query)).match
+    return lambda name: query in name
+
+
+def narrows(previous, query):
+    """query 的匹配项是否必然也匹配 previous，即可以只在上一次的结果中过滤"""
+    if not previous or "[" in previous or "[" in query:
+        return False
+    if is_glob(previous):
+        # 例如 cat* -> cat*.png：前缀相同，末尾的 * 展开后仍匹配
+        return previous.endswith("*") and query.startswith(previous)
+    # 子串查询：新查询中不含通配符的片段包含它即可
+    parts = re.split(r"[*?]", query) if is_glob(query) else [query]
+    return any(previous in part for part in parts)
+
+
+def list_directories(paths):
+    """在后台线程中枚举多个目录，返回 {路径: 枚举结果}"""
+    return {path: list_directory(path) for path in paths}
 
 
 class ImageClassifierApp:
-    def __init__(self, root):
+    def __init__(
+        self,
+        root,
+        quality="fast",
+        latency=False,
+        latency_csv=None,
+        latency_overlay=False,
+        thumb_cache=None,
+    ):
         self.root = root
+        self.quality = quality
+        # 优先从持久化的缩略图缓存加载
+        self.thumb_cache = thumb_cache
+        self.load_image = load_display_image
+        if thumb_cache is not None:
+            self.load_image = thumb_cache.load_display_image
+        # 延迟统计：未开启时为 None，回调不会被包装
+        enabled = latency or latency_csv or latency_overlay
+        self.latency = LatencyRecorder() if enabled else None
+        self.latency_csv = latency_csv
+        self.latency_overlay = latency_overlay
         self.root.title("图片分类工具")
         self.root.geometry("1200x700")
 
         # 状态变量
         self.image_files = []
         self.current_index = -1
+        self.image_size = (0, 0)
         self.current_dir = ""
         self.similar_dir = ""
         self.dissimilar_dir = ""
         self.tree_root_path = ""
         self.file_tree_items = {}  # 存储Treeview节点ID与路径的映射
+        # 目录树模型：目录路径 -> DirNode，图片路径 -> 节点ID
+        self.tree_dirs = {}
+        self.tree_images = {}
+        # 刷新后恢复的选中项，对应的选择事件不重新加载目录
+        self.restored_selection = None
+        # 刷新前展开/选中、等待父节点加载后恢复的路径
+        self.reopen = set()
+        self.reselect = set()
+        # 后台枚举目录；重建目录树后旧的枚举结果按代数丢弃
+        self.tree_loader = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tree")
+        self.tree_generation = 0
+        # 目录树的修改按时间片分批执行，监控到的变化合并后一起同步
+        self.scheduler = UiScheduler(self.root)
+        self.pending_sync = set()
+        # 搜索：整个目录树的 {路径: 小写名称} 索引，随移动和同步更新；
+        # search_paths 是其排好序的键，移除目录时按前缀区间删除
+        self.search_index = {}
+        self.search_paths = []
+        self.search_query = None
+        self.search_matches = []
+        self.search_pos = -1
+        self.search_job = None
+        # 过滤在调度器中分片执行，输入新的查询后旧的过滤按代数丢弃
+        self.search_generation = 0
+        self.search_done = True
+        self.pending_jump = None
+        # 等待上级目录加载后再选中的路径
+        self.pending_reveal = None
 
         # 创建UI布局框架
         self.create_layout()
 
         # 绑定键盘事件
-        self.root.bind("<Left>", self.prev_image)
-        self.root.bind("<Right>", self.next_image)
-
-        # 监控线程标志
-        self.monitor_running = False
-        self.monitor_thread = None
+        self.root.bind("<Left>", self.instrumented("<Left>", self.prev_image))
+        self.root.bind("<Right>", self.instrumented("<Right>", self.next_image))
+        self.root.bind("<q>", self.instrumented("<q>", self.toggle_quality))
+        # 缩放：+/- 以中心缩放，0 恢复适应窗口（滚轮和拖动在图片区域内）
+        self.root.bind("<equal>", lambda event: self.image_label.zoom_by(ZOOM_STEP))
+        self.root.bind("<plus>", lambda event: self.image_label.zoom_by(ZOOM_STEP))
+        self.root.bind("<minus>", lambda event: self.image_label.zoom_by(1 / ZOOM_STEP))
+        self.root.bind("<Key-0>", lambda event: self.image_label.fit_view())
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # 目录监控
+        self.watcher = None
+
+    def instrumented(self, name, action):
+        """开启延迟统计时包装回调，记录从触发到界面重绘完成的耗时"""
+        if self.latency is None:
+            return action
+
+        def wrapper(*args):
+            self.latency.begin(name)
+            action(*args)
+            # 重绘同样在空闲时执行，排在它之后的回调即为绘制完成的时间点
+            self.root.after_idle(self.on_painted)
+
+        return wrapper
+
+    def on_painted(self):
+        self.latency.end()
+        if self.latency_overlay:
+            self.latency_text.set(self.latency.summary())
+
+    def on_close(self):
+        self.stop_directory_monitor()
+        self.tree_loader.shutdown(wait=False, cancel_futures=True)
+        self.image_label.close()
+        if self.thumb_cache is not None:
+            self.thumb_cache.close()
+        if self.latency is not None and self.latency_csv:
+            self.latency.dump_csv(self.latency_csv)
+            print(self.latency.summary())
+        self.root.destroy()
 
     def create_layout(self):
         # 主框架（分隔为左右两部分）
@@ -49,6 +285,23 @@ class ImageClassifierApp:
         self.create_image_viewer()
 
     def create_treeview(self):
+        # 搜索框：子串或通配符（* ? []）匹配名称，回车跳到下一个匹配
+        search_frame = tk.Frame(self.left_panel)
+        search_frame.pack(fill=tk.X, padx=5, pady=(5, 0))
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.schedule_search())
+        search_entry = tk.Entry(search_frame, textvariable=self.search_var)
+        search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        # 输入时不触发窗口级的快捷键（Q 键、方向键）
+        search_entry.bindtags((str(search_entry), "Entry", "all"))
+        search_entry.bind("<Return>", lambda event: self.jump_to_match(1))
+        search_entry.bind("<Shift-Return>", lambda event: self.jump_to_match(-1))
+        search_entry.bind("<Escape>", lambda event: self.search_var.set(""))
+        self.search_status = tk.StringVar()
+        tk.Label(search_frame, textvariable=self.search_status, fg="gray").pack(
+            side=tk.RIGHT
+        )
+
         # 树视图框架
         tree_frame = tk.Frame(self.left_panel)
         tree_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -75,6 +328,7 @@ class ImageClassifierApp:
 
         # 绑定选择事件
         self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+        self.tree.bind("<<TreeviewOpen>>", self.on_tree_open)
 
         # 工具栏
         toolbar = tk.Frame(self.left_panel)
@@ -100,20 +354,31 @@ class ImageClassifierApp:
             side=tk.RIGHT, padx=10
         )
 
+        self.latency_text = tk.StringVar()
+        if self.latency_overlay:
+            tk.Label(
+                top_frame, textvariable=self.latency_text, fg="gray", justify=tk.LEFT
+            ).pack(side=tk.RIGHT, padx=10)
+
         # 图片显示区域
         self.img_frame = tk.Frame(self.right_panel, bg="#f0f0f0", height=500)
         self.img_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
 
-        self.image_label = tk.Label(self.img_frame)
+        self.image_label = TileViewer(
+            self.img_frame, self.load_image, on_zoom=self.on_zoom, bg="#f0f0f0"
+        )
         self.image_label.pack(fill=tk.BOTH, expand=True)
 
         # 底部按钮区域
         btn_frame = tk.Frame(self.right_panel, pady=15)
         btn_frame.pack(fill=tk.X)
 
-        tk.Button(btn_frame, text="← 上一张", width=10, command=self.prev_image).pack(
-            side=tk.LEFT, padx=40
-        )
+        tk.Button(
+            btn_frame,
+            text="← 上一张",
+            width=10,
+            command=self.instrumented("上一张", self.prev_image),
+        ).pack(side=tk.LEFT, padx=40)
 
         self.similar_btn = tk.Button(
             btn_frame,
@@ -122,7 +387,7 @@ class ImageClassifierApp:
             width=10,
             height=2,
             state=tk.DISABLED,
-            command=lambda: self.move_image(True),
+            command=self.instrumented("相似", lambda: self.move_image(True)),
         )
         self.similar_btn.pack(side=tk.LEFT, padx=10)
 
@@ -133,20 +398,46 @@ class ImageClassifierApp:
             width=10,
             height=2,
             state=tk.DISABLED,
-            command=lambda: self.move_image(False),
+            command=self.instrumented("不相似", lambda: self.move_image(False)),
         )
         self.dissimilar_btn.pack(side=tk.LEFT, padx=10)
 
-        tk.Button(btn_frame, text="下一张 →", width=10, command=self.next_image).pack(
-            side=tk.RIGHT, padx=40
-        )
+        tk.Button(
+            btn_frame,
+            text="下一张 →",
+            width=10,
+            command=self.instrumented("下一张", self.next_image),
+        ).pack(side=tk.RIGHT, padx=40)
 
     def build_treeview(self, path):
-        """构建目录树结构"""
-        # 清空现有树
+        """
+        构建目录树结构：只插入根节点，子节点在展开时按需加载
+
+        刷新前已展开和已选中的节点在其父节点加载后恢复。
+        """
+        opened = {
+            node_path
+            for node_path, node in self.tree_dirs.items()
+            if self.tree.item(node.item, "open")
+        }
+        selected = {self.file_tree_items.get(item) for item in self.tree.selection()}
+
+        # 清空现有树，丢弃尚未返回的枚举结果
         for item in self.tree.get_children():
             self.tree.delete(item)
         self.file_tree_items.clear()
+        self.tree_dirs.clear()
+        self.tree_images.clear()
+        self.tree_generation += 1
+        self.scheduler.clear()
+        self.pending_sync.clear()
+        self.search_index = {}
+        self.search_paths = []
+        self.search_query = None
+        self.search_generation += 1
+        self.search_done = True
+        self.pending_jump = None
+        self.pending_reveal = None
 
         if not path:
             return
@@ -163,115 +454,443 @@ class ImageClassifierApp:
             tags=("root",),
         )
         self.file_tree_items[root_item] = path
+        self.tree_dirs[path] = DirNode(root_item)
+        if path in selected:
+            self.restored_selection = (root_item,)
+            self.tree.selection_set(root_item)
+        self.reopen = opened
+        self.reselect = selected - {None}
+        self.expand_node(path)
+        self.request_search_index(path)
+
+        # 启动目录监控
+        self.start_directory_monitor(path)
 
-        # 递归添加子节点
-        self.add_tree_nodes(root_item, path)
+    def path_item(self, path):
+        """返回路径对应的节点ID，不在树中时返回 None"""
+        node = self.tree_dirs.get(path)
+        if node is not None:
+            return node.item
+        return self.tree_images.get(path)
+
+    def on_tree_open(self, event):
+        """展开节点时按需加载其子节点"""
+        path = self.file_tree_items.get(self.tree.focus())
+        if path is not None:
+            self.expand_node(path)
+
+    def expand_node(self, path):
+        """已枚举过的目录直接填充子节点，否则在后台枚举，结果返回后再填充"""
+        node = self.tree_dirs.get(path)
+        if node is None or node.loaded:
+            return
+        if node.listed:
+            self.populate_node(path)
+        else:
+            self.request_listings([path], self.on_listings)
+
+    def request_listings(self, paths, handler):
+        """在后台线程中枚举 paths，结果通过 after() 交给 UI 线程的 handler"""
+        generation = self.tree_generation
+        future = self.tree_loader.submit(list_directories, paths)
+        future.add_done_callback(
+            lambda f: self.root.after(0, handler, f.result(), generation)
+        )
 
-        # 启动目录监控线程
-        self.start_directory_monitor(path)
+    def on_listings(self, listings, generation):
+        if generation != self.tree_generation:
+            return
+        for path, listing in listings.items():
+            node = self.tree_dirs.get(path)
+            if node is None or node.loaded or node.populating:
+                continue
+            node.count, node.dirs, node.images = listing or (0, [], [])
+            node.listed = True
+            self.show_item_count(path)
+            if self.tree.item(node.item, "open"):
+                self.populate_node(path)
+            elif not node.dirs and not node.images:
+                # 空目录不需要展开标记
+                self.remove_placeholder(node)
+
+    def populate_node(self, path):
+        """把已枚举的子目录和图片分片插入 Treeview"""
+        node = self.tree_dirs[path]
+        if node.loaded or node.populating:
+            return
+        node.populating = True
+        self.scheduler.add(self.populate_task(path, node))
+
+    def populate_task(self, path, node):
+        """每插入一个节点让出一次；完成后补上期间的修改，并在后台预先枚举子目录"""
+        self.remove_placeholder(node)
+        for is_dir, names in ((True, list(node.dirs)), (False, list(node.images))):
+            for name in names:
+                if self.tree_dirs.get(path) is not node:
+                    # 目录已被移除或目录树已重建
+                    return
+                self.insert_tree_node(path, name, is_dir, "end")
+                yield
+        node.populating = False
+        node.loaded = True
+        deferred, node.deferred = node.deferred, []
+        for func, args in deferred:
+            func(*args)
+        if self.pending_reveal is not None:
+            self.continue_reveal()
+        # 子目录的项目数来自同一次枚举，之后展开也无需等待
+        if node.dirs:
+            children = [os.path.join(path, name) for name in node.dirs]
+            self.request_listings(children, self.on_listings)
+
+    def remove_placeholder(self, node):
+        if node.placeholder is not None:
+            self.tree.delete(node.placeholder)
+            node.placeholder = None
+
+    def insert_tree_node(self, parent_path, name, is_dir, index):
+        """在 index 处插入一个目录（带占位子节点）或图片节点"""
+        parent = self.tree_dirs[parent_path]
+        path = os.path.join(parent_path, name)
+        if is_dir:
+            item = self.tree.insert(
+                parent.item, index, text=name, values=("目录", ""), tags=("folder",)
+            )
+            node = self.tree_dirs[path] = DirNode(item)
+            node.placeholder = self.tree.insert(
+                item, "end", text="加载中…", tags=("placeholder",)
+            )
+            if path in self.reopen:
+                self.reopen.discard(path)
+                self.tree.item(item, open=True)
+                self.expand_node(path)
+        else:
+            item = self.tree.insert(
+                parent.item, index, text=name, values=("图片", ""), tags=("image",)
+            )
+            self.tree_images[path] = item
+        self.file_tree_items[item] = path
+        if path in self.reselect:
+            self.reselect.discard(path)
+            self.tree.selection_add(item)
+            self.restored_selection = self.tree.selection()
+
+    def show_item_count(self, path):
+        if path != self.tree_root_path:
+            node = self.tree_dirs[path]
+            self.tree.set(node.item, "2", f"{node.count}")
+
+    def add_tree_child(self, parent_path, name, is_dir):
+        """按排序位置加入一个新出现的子节点，并更新父目录的项目数"""
+        parent = self.tree_dirs[parent_path]
+        if parent.populating:
+            parent.deferred.append((self.add_tree_child, (parent_path, name, is_dir)))
+            return
+        if not parent.listed:
+            # 还没有枚举结果，结果返回时自然包含该变化
+            return
+        names = parent.dirs if is_dir else parent.images
+        position = bisect.bisect_left(names, name)
+        if position < len(names) and names[position] == name:
+            return
+        names.insert(position, name)
+        parent.count += 1
+        self.show_item_count(parent_path)
+        path = os.path.join(parent_path, name)
+        self.index_add(path, name)
+        if parent.loaded:
+            index = position if is_dir else len(parent.dirs) + position
+            self.insert_tree_node(parent_path, name, is_dir, index)
+            if is_dir:
+                self.request_listings([path], self.on_listings)
+        elif parent.placeholder is None:
+            parent.placeholder = self.tree.insert(
+                parent.item, "end", text="加载中…", tags=("placeholder",)
+            )
 
-    def add_tree_nodes(self, parent_id, parent_path):
-        """递归添加目录和文件到树视图"""
-        try:
-            # 添加目录节点
-            for item in sorted(os.listdir(parent_path)):
-                item_path = os.path.join(parent_path, item)
-                if os.path.isdir(item_path) and not item.startswith("."):
-                    # 计算目录中的项目数量
-                    item_count = len(os.listdir(item_path))
-                    item_id = self.tree.insert(
-                        parent_id,
-                        "end",
-                        text=item,
-                        values=("目录", f"{item_count}"),
-                        tags=("folder",),
-                    )
-                    self.file_tree_items[item_id] = item_path
-                    # 递归处理子目录
-                    self.add_tree_nodes(item_id, item_path)
-
-            # 添加图片文件节点（仅限顶级目录）
-            for item in sorted(os.listdir(parent_path)):
-                item_path = os.path.join(parent_path, item)
-                if os.path.isfile(item_path) and item.lower().endswith(
-                    (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+    def remove_tree_child(self, parent_path, name, is_dir):
+        """移除一个子节点（目录连同其下所有节点），并更新父目录的项目数"""
+        parent = self.tree_dirs[parent_path]
+        if parent.populating:
+            parent.deferred.append(
+                (self.remove_tree_child, (parent_path, name, is_dir))
+            )
+            return
+        if not parent.listed:
+            return
+        names = parent.dirs if is_dir else parent.images
+        position = bisect.bisect_left(names, name)
+        if position >= len(names) or names[position] != name:
+            return
+        del names[position]
+        parent.count -= 1
+        self.show_item_count(parent_path)
+        path = os.path.join(parent_path, name)
+        self.index_remove(path, is_dir)
+        if not parent.loaded:
+            if not parent.dirs and not parent.images:
+                self.remove_placeholder(parent)
+            return
+        if is_dir:
+            item = self.forget_tree_dir(path)
+        else:
+            item = self.tree_images.pop(path)
+            del self.file_tree_items[item]
+        self.tree.delete(item)
+
+    def forget_tree_dir(self, path):
+        """沿目录模型遍历子树，只从节点表中删除其中已插入的节点，返回目录的节点 ID"""
+        node = self.tree_dirs.pop(path)
+        item = node.item
+        del self.file_tree_items[item]
+        stack = [(path, node)]
+        while stack:
+            path, node = stack.pop()
+            for name in node.dirs:
+                child = self.tree_dirs.pop(os.path.join(path, name), None)
+                if child is not None:
+                    del self.file_tree_items[child.item]
+                    stack.append((os.path.join(path, name), child))
+            for name in node.images:
+                image = self.tree_images.pop(os.path.join(path, name), None)
+                if image is not None:
+                    del self.file_tree_items[image]
+        return item
+
+    def on_file_moved(self, src_path, dest_path):
+        """移动图片后只更新源目录、目标目录和图片节点"""
+        src_dir, name = os.path.split(src_path)
+        dest_dir = os.path.dirname(dest_path)
+        # 搜索索引覆盖整个目录树，包括尚未加载的目录
+        self.index_remove(src_path)
+        self.index_add(dest_dir, os.path.basename(dest_dir))
+        self.index_add(dest_path, name)
+        if src_dir in self.tree_dirs:
+            self.remove_tree_child(src_dir, name, False)
+        if dest_dir not in self.tree_dirs:
+            # 第一次移入时才创建的 相似/不相似 目录，其内容由后台枚举得到
+            parent_path, dir_name = os.path.split(dest_dir)
+            if parent_path in self.tree_dirs:
+                self.add_tree_child(parent_path, dir_name, True)
+            return
+        self.add_tree_child(dest_dir, name, False)
+
+    def sync_directories(self, paths):
+        """在后台重新枚举发生变化的目录（每个目录只枚举这一层），再增量同步"""
+        paths = [path for path in paths if path in self.tree_dirs]
+        if paths:
+            self.request_listings(paths, self.on_synced)
+
+    def on_synced(self, listings, generation):
+        if generation == self.tree_generation:
+            self.scheduler.add(self.sync_task(listings, generation))
+
+    def sync_task(self, listings, generation):
+        """把枚举结果与模型的差异逐个应用到 Treeview，每次修改后让出"""
+        for path in sorted(listings):
+            node = self.tree_dirs.get(path)
+            listing = listings[path]
+            if node is None or not node.listed or listing is None:
+                # 未枚举过的目录不需要同步；已删除的目录由父目录的同步移除
+                continue
+            if node.populating:
+                # 等子节点插入完成后重新同步
+                node.deferred.append((self.sync_directories, ([path],)))
+                continue
+            count, dirs, images = listing
+            changes = [
+                *(
+                    (self.remove_tree_child, n, True)
+                    for n in set(node.dirs) - set(dirs)
+                ),
+                *(
+                    (self.remove_tree_child, n, False)
+                    for n in set(node.images) - set(images)
+                ),
+                *(
+                    (self.add_tree_child, n, True)
+                    for n in sorted(set(dirs) - set(node.dirs))
+                ),
+                *(
+                    (self.add_tree_child, n, False)
+                    for n in sorted(set(images) - set(node.images))
+                ),
+            ]
+            for func, name, is_dir in changes:
+                if (
+                    generation != self.tree_generation
+                    or self.tree_dirs.get(path) is not node
                 ):
-                    self.tree.insert(
-                        parent_id,
-                        "end",
-                        text=item,
-                        values=("图片", ""),
-                        tags=("image",),
-                    )
-
-        except PermissionError:
-            # 处理可能遇到的权限问题
-            pass
-
-    def start_directory_monitor(self, path):
-        """启动目录监控线程"""
-        if self.monitor_running:
-            self.monitor_running = False
-            if self.monitor_thread and self.monitor_thread.is_alive():
-                self.monitor_thread.join(timeout=1)
-
-        self.monitor_running = True
-        self.monitor_thread = threading.Thread(
-            target=self.monitor_directory_changes, args=(path,), daemon=True
+                    return
+                func(path, name, is_dir)
+                yield
+            node.count = count
+            self.show_item_count(path)
+
+    def request_search_index(self, path):
+        generation = self.tree_generation
+        future = self.tree_loader.submit(walk_names, path)
+        future.add_done_callback(
+            lambda f: self.root.after(0, self.on_search_index, f.result(), generation)
         )
-        self.monitor_thread.start()
-
-    def monitor_directory_changes(self, path):
-        """监控目录变化并更新树视图"""
-        last_state = {}
-
-        # 初始快照
-        for root, dirs, files in os.walk(path):
-            for name in dirs + files:
-                item_path = os.path.join(root, name)
-                last_state[item_path] = os.path.getmtime(item_path)
-
-        while self.monitor_running:
-            time.sleep(1)  # 每1秒检查一次
-
-            changed = False
-            new_state = {}
-
-            # 获取新快照
-            for root, dirs, files in os.walk(path):
-                for name in dirs + files:
-                    item_path = os.path.join(root, name)
-                    try:
-                        mtime = os.path.getmtime(item_path)
-                        new_state[item_path] = mtime
-
-                        # 如果文件新创建或修改
-                        if (
-                            item_path not in last_state
-                            or last_state[item_path] != mtime
-                        ):
-                            changed = True
-                    except FileNotFoundError:
-                        # 文件可能被删除
-                        changed = True
-
-            # 检查删除的文件
-            for item_path in list(last_state.keys()):
-                if item_path not in new_state:
-                    changed = True
-                    break
-
-            if changed:
-                last_state = new_state
-                # 在UI线程中更新树视图
-                self.root.after(0, self.refresh_treeview)
-
-            # 检查是否继续运行
-            if not self.monitor_running:
+
+    def on_search_index(self, index, generation):
+        if generation != self.tree_generation:
+            return
+        # 构建期间发生的移动和同步以当前索引为准；walk_names 的结果已按路径排序
+        paths = list(index)
+        for path in self.search_paths:
+            if path not in index:
+                bisect.insort(paths, path)
+        index.update(self.search_index)
+        self.search_index = index
+        self.search_paths = paths
+        self.search_query = None
+        self.update_search()
+
+    def schedule_search(self):
+        """输入停顿后再过滤，连续输入只过滤一次"""
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(150, self.update_search)
+
+    def index_add(self, path, name):
+        if path not in self.search_index:
+            bisect.insort(self.search_paths, path)
+        self.search_index[path] = name.lower()
+
+    def index_remove(self, path, subtree=False):
+        """从搜索索引移除 path；subtree 为真时连同其下所有路径（有序列表中的一段连续区间）"""
+        paths = self.search_paths
+        if self.search_index.pop(path, None) is not None:
+            del paths[bisect.bisect_left(paths, path)]
+        if subtree:
+            prefix = path + os.sep
+            lo = bisect.bisect_left(paths, prefix)
+            hi = bisect.bisect_left(paths, prefix + "\U0010ffff", lo)
+            for child in paths[lo:hi]:
+                del self.search_index[child]
+            del paths[lo:hi]
+
+    def update_search(self):
+        self.search_job = None
+        query = self.search_var.get().strip().lower()
+        if query == self.search_query:
+            return
+        if self.search_done and narrows(self.search_query, query):
+            # 在上一次的结果中继续缩小范围
+            candidates = self.search_matches
+        else:
+            # 快照路径列表，过滤期间索引仍会随移动和同步更新
+            candidates = list(self.search_paths) if query else []
+        self.search_generation += 1
+        self.search_query = query
+        self.search_matches = []
+        self.search_pos = -1
+        self.search_done = False
+        self.search_status.set("搜索中…" if query else "")
+        self.scheduler.add(self.search_task(query, candidates, self.search_generation))
+
+    def search_task(self, query, candidates, generation, chunk: int = 1000):
+        """分片过滤 candidates，每 chunk 个名称让出一次"""
+        match = compile_query(query)
+        matches = []
+        for start in range(0, len(candidates), chunk):
+            if generation != self.search_generation:
+                return
+            index = self.search_index
+            for path in candidates[start : start + chunk]:
+                # 过滤期间被移除的路径取不到名称
+                name = index.get(path)
+                if name is not None and match(name):
+                    matches.append(path)
+            yield
+        if generation != self.search_generation:
+            return
+        self.search_matches = matches
+        self.search_done = True
+        self.search_status.set(f"{len(matches)} 个匹配" if query else "")
+        if self.pending_jump is not None:
+            step, self.pending_jump = self.pending_jump, None
+            self.jump_to_match(step)
+
+    def jump_to_match(self, step):
+        """跳到下一个（step=-1 时上一个）匹配项，过滤尚未完成时等完成后再跳"""
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+            self.update_search()
+        if not self.search_done:
+            self.pending_jump = step
+            return
+        matches = self.search_matches
+        for _ in range(len(matches)):
+            self.search_pos = (self.search_pos + step) % len(matches)
+            path = matches[self.search_pos]
+            if path in self.search_index:
                 break
+        else:
+            return
+        self.search_status.set(f"{self.search_pos + 1}/{len(matches)}")
+        self.reveal_path(path)
+
+    def reveal_path(self, path):
+        """展开 path 的各级上级目录（按需加载）后选中并滚动到该节点"""
+        self.pending_reveal = path
+        self.continue_reveal()
+
+    def continue_reveal(self):
+        path = self.pending_reveal
+        item = self.path_item(path)
+        if item is not None:
+            self.pending_reveal = None
+            self.tree.see(item)
+            self.tree.focus(item)
+            self.tree.selection_set(item)
+            return
+        # 找到已在树中的最深一级上级目录并展开，加载完成后继续
+        ancestor = os.path.dirname(path)
+        while ancestor not in self.tree_dirs:
+            parent = os.path.dirname(ancestor)
+            if parent == ancestor:
+                self.pending_reveal = None
+                return
+            ancestor = parent
+        node = self.tree_dirs[ancestor]
+        if node.loaded:
+            # 上级目录已加载但其中没有该项（已被移动或删除）
+            self.pending_reveal = None
+            return
+        self.tree.item(node.item, open=True)
+        self.expand_node(ancestor)
+
+    def start_directory_monitor(self, path):
+        """启动目录监控（inotify，不可用时轮询目录 mtime）"""
+        self.stop_directory_monitor()
+        self.watcher = watch_directory(path, self.on_directories_changed)
+
+    def stop_directory_monitor(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def on_directories_changed(self, directories):
+        """在监控线程中调用：把一批合并后的变化交给 UI 线程同步"""
+        self.root.after(0, self.queue_sync, directories)
+
+    def queue_sync(self, directories):
+        """合并尚未同步的目录，调度器空闲时一次同步"""
+        self.pending_sync.update(directories)
+        self.scheduler.request("sync", self.flush_sync)
+
+    def flush_sync(self):
+        paths, self.pending_sync = self.pending_sync, set()
+        self.sync_directories(paths)
 
     def refresh_treeview(self):
-        """刷新目录树视图"""
+        """请求重新构建整个目录树视图（仅用于手动刷新），连续的请求只执行一次"""
+        self.scheduler.request("refresh", self.rebuild_treeview)
+
+    def rebuild_treeview(self):
         if self.tree_root_path and os.path.exists(self.tree_root_path):
             self.build_treeview(self.tree_root_path)
 
@@ -281,6 +900,12 @@ class ImageClassifierApp:
         if not selected_items:
             return
 
+        if selected_items == self.restored_selection:
+            # 刷新后恢复的选中状态，不重新加载
+            self.restored_selection = None
+            return
+        self.restored_selection = None
+
         selected_id = selected_items[0]
         path = self.file_tree_items.get(selected_id)
 
@@ -295,9 +920,13 @@ class ImageClassifierApp:
             if file_dir != self.current_dir:
                 self.load_images_from_directory(file_dir)
 
-            # 在文件列表中定位选中的文件
-            if filename in self.image_files:
-                self.current_index = self.image_files.index(filename)
+            # 在文件列表中定位选中的文件（image_files 保持有序，二分查找）
+            position = bisect.bisect_left(self.image_files, filename)
+            if (
+                position < len(self.image_files)
+                and self.image_files[position] == filename
+            ):
+                self.current_index = position
                 self.show_current_image()
 
     def load_images_from_directory(self, directory):
@@ -315,14 +944,14 @@ class ImageClassifierApp:
             f
             for f in os.listdir(directory)
             if os.path.isfile(os.path.join(directory, f))
-            and f.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".bmp"))
+            and f.lower().endswith(IMAGE_EXTENSIONS)
         ]
         self.image_files.sort()
 
         if not self.image_files:
             self.status_var.set("目录中没有找到图片文件")
             self.update_buttons_state(tk.DISABLED)
-            self.image_label.config(image=None)
+            self.image_label.clear()
             return
 
         self.current_index = 0
@@ -344,30 +973,37 @@ class ImageClassifierApp:
 
         img_path = os.path.join(self.current_dir, self.image_files[self.current_index])
         try:
-            # 加载图片并调整大小
-            img = Image.open(img_path)
-            width, height = img.size
-            max_size = 800
-            if max(width, height) > max_size:
-                ratio = max_size / max(width, height)
-                img = img.resize(
-                    (int(width * ratio), int(height * ratio)), Image.LANCZOS
-                )
-
-            # 显示图片
-            photo = ImageTk.PhotoImage(img)
-            self.image_label.config(image=photo)
-            self.image_label.image = photo
-
-            # 更新状态
-            self.status_var.set(
-                f"{self.current_index + 1}/{len(self.image_files)}: "
-                f"{self.image_files[self.current_index]} "
-                f"({img.size[0]}×{img.size[1]})"
-            )
+            # 适应窗口显示（不放大），放大后按需解码可见的小块
+            timings = self.latency.timings if self.latency is not None else None
+            start = time.perf_counter()
+            self.image_size = self.image_label.show(img_path, self.quality, timings)
+            if self.latency is not None:
+                # 解码和缩放已计入 decode/resize，其余为切块和创建 PhotoImage
+                elapsed = time.perf_counter() - start
+                decode = timings.get("decode", 0.0) + timings.get("resize", 0.0)
+                self.latency.add("photo", max(elapsed - decode, 0.0))
+            self.update_image_status()
         except Exception as e:
             print(f"Error loading image: {e}")
 
+    def on_zoom(self, zoom):
+        if self.image_files and self.current_index >= 0:
+            self.update_image_status()
+
+    def update_image_status(self):
+        width, height = self.image_size
+        self.status_var.set(
+            f"{self.current_index + 1}/{len(self.image_files)}: "
+            f"{self.image_files[self.current_index]} "
+            f"({width}×{height}, {self.image_label.zoom:.0%})"
+        )
+
+    def toggle_quality(self, event=None):
+        """在 fast 和 exact 两种显示质量之间切换"""
+        index = QUALITY_MODES.index(self.quality)
+        self.quality = QUALITY_MODES[(index + 1) % len(QUALITY_MODES)]
+        self.show_current_image()
+
     def prev_image(self, event=None):
         if not self.image_files or self.current_index <= 0:
             return
@@ -394,14 +1030,19 @@ class ImageClassifierApp:
         dest_path = os.path.join(target_dir, filename)
 
         try:
+            start = time.perf_counter()
             shutil.move(src_path, dest_path)
+            if self.latency is not None:
+                self.latency.add("move", time.perf_counter() - start)
+            # 增量更新目录树
+            self.on_file_moved(src_path, dest_path)
 
             # 更新列表和索引
             del self.image_files[self.current_index]
             if not self.image_files:
                 self.current_index = -1
                 self.update_buttons_state(tk.DISABLED)
-                self.image_label.config(image=None)
+                self.image_label.clear()
                 self.status_var.set("已完成所有图片分类!")
             else:
                 if self.current_index >= len(self.image_files):
@@ -410,21 +1051,54 @@ class ImageClassifierApp:
         except Exception as e:
             print(f"移动文件失败: {e}")
 
-        # 更新目录树
-        self.refresh_treeview()
-
     def update_buttons_state(self, state):
         self.similar_btn.config(state=state)
         self.dissimilar_btn.config(state=state)
 
     def __del__(self):
-        # 停止监控线程
-        self.monitor_running = False
-        if self.monitor_thread and self.monitor_thread.is_alive():
-            self.monitor_thread.join(timeout=1)
+        # 停止目录监控
+        self.stop_directory_monitor()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="图片相似分类工具（有侧边栏）")
+    parser.add_argument(
+        "--latency", action="store_true", help="记录操作到绘制完成的延迟"
+    )
+    parser.add_argument(
+        "--latency-csv", help="退出时把延迟样本导出到该 CSV 文件（隐含 --latency）"
+    )
+    parser.add_argument(
+        "--latency-overlay",
+        action="store_true",
+        help="在窗口中显示延迟的 p50/p95/p99",
+    )
+    parser.add_argument(
+        "--thumb-cache-dir", default=str(DEFAULT_CACHE_DIR), help="缩略图缓存目录"
+    )
+    parser.add_argument(
+        "--thumb-cache-mb",
+        type=int,
+        default=2048,
+        help="缩略图缓存上限 MB（默认 2048）",
+    )
+    parser.add_argument(
+        "--no-thumb-cache", action="store_true", help="不使用持久化的缩略图缓存"
+    )
+    args = parser.parse_args()
+
+    thumb_cache = None
+    if not args.no_thumb_cache:
+        thumb_cache = ThumbnailCache(
+            args.thumb_cache_dir, args.thumb_cache_mb * 1024**2
+        )
+
     root = tk.Tk()
-    app = ImageClassifierApp(root)
+    app = ImageClassifierApp(
+        root,
+        latency=args.latency,
+        latency_csv=args.latency_csv,
+        latency_overlay=args.latency_overlay,
+        thumb_cache=thumb_cache,
+    )
     root.mainloop()